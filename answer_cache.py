@@ -0,0 +1,65 @@
+"""
+In-memory cache of GameBot answers.
+Each answer is tagged with the groups of tables it was read from ("games", "relations"). Writes through the bot
+invalidate only the answers tagged with what they wrote; commits by other connections (e.g. igdb_scrape.py refreshing
+the games) are noticed through PRAGMA data_version and invalidate everything.
+"""
+import sqlite3
+from collections import OrderedDict
+
+class AnswerCache:
+    """Bounded LRU cache of answers with dependency tags and hit/miss counters"""
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (value, tags)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data_version = None
+
+    def _check_data_version(self, con):
+        # data_version only changes when another connection commits
+        version = con.execute("PRAGMA data_version;").fetchone()[0]
+        if version != self._data_version:
+            if self._data_version is not None: self.clear()
+            self._data_version = version
+
+    def get(self, key, con : sqlite3.Connection):
+        """Returns the cached answer for key, or None"""
+        self._check_data_version(con)
+
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, tags):
+        self.entries[key] = (value, frozenset(tags))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, tag):
+        """Drops every answer read from the given group of tables"""
+        stale = [key for key, (value, tags) in self.entries.items() if tag in tags]
+        for key in stale:
+            del self.entries[key]
+        self.invalidations += len(stale)
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "entries": len(self.entries)
+        }
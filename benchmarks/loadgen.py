@@ -0,0 +1,81 @@
+"""
+Load generator for server.py: opens many concurrent conversations and reports throughput and latency percentiles.
+Usage: python benchmarks/loadgen.py [--host HOST] [--port PORT] [--sessions N] [--requests M] [questions file]
+The questions file has one question per line; "{game}" is replaced by a random title from --titles.
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+
+QUESTIONS = [
+    "When was {game} released?",
+    "What is the rating of {game}?",
+    "What is the story of {game}?",
+    "What franchises is {game} part of?",
+    "How is {game} rated?",
+]
+
+TITLES = ["Super Mario Bros.", "The Witcher 3", "Minecraft", "Portal 2", "Hollow Knight", "Celeste", "Halo 3", "Tetris"]
+
+async def conversation(host, port, session, requests, questions, titles, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port, limit=2**20)
+    try:
+        writer.write(json.dumps({"username": f"user{session}"}).encode("utf-8") + b"\n")
+        await writer.drain()
+        await reader.readline()
+
+        for i in range(requests):
+            text = random.choice(questions).format(game=random.choice(titles))
+            start = time.perf_counter()
+            writer.write(json.dumps({"id": i, "text": text}).encode("utf-8") + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if not response.get("ok"):
+                errors.append(response)
+    finally:
+        writer.close()
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def main(args):
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(args.host, args.port, session, args.requests, questions, args.titles, latencies, errors)
+                           for session in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "sessions": args.sessions,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    ap = ArgumentParser(description="Measures throughput and latency of a running server.py")
+    ap.add_argument("questions", nargs="?", default=None, help="File with one question template per line")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--sessions", type=int, default=200, help="Concurrent conversations")
+    ap.add_argument("--requests", type=int, default=20, help="Questions per conversation")
+    ap.add_argument("--titles", nargs="+", default=TITLES, help="Game titles to ask about")
+    args = ap.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,257 @@
+"""
+Benchmark suite of the HLT Chatbot.
+Generates (or reuses) a synthetic catalogue of the given scale, starts the stub CoreNLP server on its recorded
+annotations, and times these scenarios:
+    title_lookup      GameBot.find_games on exact, lowercase, prefix and misspelled titles
+    relation_queries  find_relations / find_relations_like on subjects and predicates of the catalogue
+    random_facts      get_random_fact, overall and within a franchise
+    qa_fast           templated questions answered without a parse
+    qa_parse          questions that go through the (stub) CoreNLP parse
+    preprocess        preprocess_db_streaming on a catalogue without relations
+Results are written as JSON with the commit they were measured on, so runs can be compared with --compare.
+Runs offline without Java, but all scenarios except title_lookup and random_facts need NLTK's tokenizer, tagger and
+WordNet data, which is checked before they run:
+    python -m nltk.downloader punkt_tab averaged_perceptron_tagger_eng wordnet
+(punkt and averaged_perceptron_tagger instead on NLTK releases before 3.9)
+Usage: python benchmarks/run.py [--games N] [--workdir DIR] [--output results.json] [--compare old.json] [scenarios...]
+"""
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+import synthetic
+from stub_corenlp import StubCoreNLPServer, load_recordings
+
+SCENARIOS = ["title_lookup", "relation_queries", "random_facts", "qa_fast", "qa_parse", "preprocess"]
+
+# NLTK data the bot loads lazily, as (package, resource path) alternatives for current and older NLTK releases
+NLTK_DATA = [
+    [("punkt_tab", "tokenizers/punkt_tab/english/"), ("punkt", "tokenizers/punkt")],
+    [("averaged_perceptron_tagger_eng", "taggers/averaged_perceptron_tagger_eng/"),
+     ("averaged_perceptron_tagger", "taggers/averaged_perceptron_tagger")],
+    [("wordnet", "corpora/wordnet")],
+]
+# Scenarios that tokenize, tag or lemmatize, and so need NLTK_DATA
+NLTK_SCENARIOS = {"relation_queries", "qa_fast", "qa_parse", "preprocess"}
+
+def missing_nltk_data():
+    """Packages of the NLTK data that isn't installed, so runs fail up front instead of in the middle of a scenario"""
+    import nltk
+
+    missing = []
+    for alternatives in NLTK_DATA:
+        for package, resource in alternatives:
+            try:
+                nltk.data.find(resource)
+                break
+            except LookupError:
+                pass
+        else:
+            missing.append(alternatives[0][0])
+    return missing
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def measure(operations, warmup=10):
+    """Runs each operation (a callable) once after a few warm-up runs; returns the scenario's result"""
+    for operation in operations[:warmup]:
+        operation()
+
+    latencies = []
+    start = time.perf_counter()
+    for operation in operations:
+        begin = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "seconds": round(elapsed, 4),
+        "ops_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+    }
+
+def misspell(rng, title):
+    i = rng.randrange(len(title) - 1)
+    return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+
+def title_lookup(bot, games, rng, ops):
+    operations = []
+    for i in range(ops):
+        title = synthetic.title_of(rng.randrange(games))
+        kind = i % 10
+        if kind < 6: descriptor = title
+        elif kind < 8: descriptor = title.lower()
+        elif kind < 9: descriptor = title.split()[0] + " " + title.split()[1][:3]
+        else: descriptor = misspell(rng, title)
+        operations.append(lambda descriptor=descriptor: bot.find_games(descriptor))
+    return measure(operations)
+
+def relation_queries(bot, games, rng, ops):
+    operations = []
+    for i in range(ops):
+        if i % 2 == 0:
+            subject, lemma = rng.choice(synthetic.HEROES), rng.choice(synthetic.VERBS)[1]
+            operations.append(lambda subject=subject, lemma=lemma: bot.find_relations_like(subject=subject, relation=lemma))
+        else:
+            title = synthetic.title_of(rng.randrange(games)).lower()
+            operations.append(lambda title=title: bot.find_relations(subject=title, relation="be"))
+    return measure(operations)
+
+def random_facts(bot, games, rng, ops):
+    franchises = [row[0] for row in bot.cur.execute("SELECT id FROM franchises;")]
+    operations = []
+    for i in range(ops):
+        franchise = rng.choice(franchises) if i % 2 and franchises else None
+        operations.append(lambda franchise=franchise: bot.get_random_fact(franchise_id=franchise))
+    return measure(operations)
+
+def _answer(bot, question):
+    bot.answer_cache.clear() # Measure the answer itself, not the cache
+    return bot.respond(question)
+
+def qa_fast(bot, games, rng, ops):
+    templates = ["When was {} released?", "What is the rating of {}?", "What is the story of {}?",
+                 "What franchises is {} part of?", "How is {} rated?"]
+    questions = [rng.choice(templates).format(synthetic.title_of(rng.randrange(games))) for i in range(ops)]
+    return measure([lambda question=question: _answer(bot, question) for question in questions])
+
+def qa_parse(bot, games, rng, ops):
+    questions = [sentence.text for sentence in synthetic.questions(games)]
+    return measure([lambda question=question: _answer(bot, question) for question in rng.choices(questions, k=ops)])
+
+def preprocess(path, parser, games):
+    from utils import preprocess_db_streaming
+
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+    cur.execute("DELETE FROM relations;")
+    cur.execute("DELETE FROM metadata WHERE key = 'bot_preprocess_last_id';")
+    con.commit()
+
+    start = time.perf_counter()
+    processed = preprocess_db_streaming(con, cur, limit=games, parsers=[parser])
+    elapsed = time.perf_counter() - start
+    relations = cur.execute("SELECT COUNT(*) FROM relations;").fetchone()[0]
+    con.close()
+    return {"games": processed, "relations": relations, "seconds": round(elapsed, 4),
+            "games_per_s": round(processed / elapsed, 1)}
+
+def prepare(workdir, games, seed, preprocess_games):
+    """Generates the catalogues of this scale unless they're already in workdir; returns their paths"""
+    from bot import GameBot
+
+    os.makedirs(workdir, exist_ok=True)
+    catalogue = os.path.join(workdir, f"games-{games}-{seed}.sqlite")
+    annotations = os.path.join(workdir, f"annotations-{games}-{seed}.jsonl")
+    raw = os.path.join(workdir, f"raw-{preprocess_games}-{seed}.sqlite")
+
+    if not os.path.exists(catalogue) or not os.path.exists(annotations):
+        for path in (catalogue, annotations):
+            if os.path.exists(path): os.remove(path)
+        print(f"Generating {games} games...", file=sys.stderr)
+        start = time.perf_counter()
+        synthetic.generate(catalogue, games, seed, annotations, annotated_games=preprocess_games)
+        print(f"Generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        GameBot(catalogue, interactive=False).con.close() # Indexes and triggers aren't part of the timings
+    if not os.path.exists(raw):
+        synthetic.generate(raw, preprocess_games, seed, with_relations=False)
+        GameBot(raw, interactive=False).con.close()
+
+    return catalogue, annotations, raw
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Prints the throughput of each scenario relative to a baseline result file"""
+    print(f"{'scenario':<18} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, result in results["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None: continue
+        key = "games_per_s" if name == "preprocess" else "ops_per_s"
+        print(f"{name:<18} {old[key]:>12} {result[key]:>12} {result[key] / old[key]:>7.2f}x")
+
+def main(args):
+    import corenlp
+    from bot import GameBot
+
+    catalogue, annotations, raw = prepare(args.workdir, args.games, args.seed, args.preprocess_games)
+    stub = StubCoreNLPServer(load_recordings(annotations), delay=args.corenlp_delay_ms / 1000).start()
+    parser = corenlp.attach(stub.url)
+
+    rng = random.Random(args.seed)
+    bot = GameBot(catalogue, interactive=False)
+    bot.username = "benchmark"
+
+    results = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "games": args.games,
+        "seed": args.seed,
+        "scenarios": {}
+    }
+
+    for name in args.scenarios or SCENARIOS:
+        print(f"Running {name}...", file=sys.stderr)
+        if name == "preprocess":
+            result = preprocess(raw, parser, args.preprocess_games)
+        else:
+            result = globals()[name](bot, args.games, rng, args.ops)
+        results["scenarios"][name] = result
+
+    results["corenlp_stub"] = stub.stats()
+    stub.stop()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    ap = ArgumentParser(description="Runs the benchmark scenarios on a synthetic catalogue")
+    ap.add_argument("scenarios", nargs="*", help=f"Scenarios to run (all by default): {', '.join(SCENARIOS)}")
+    ap.add_argument("--games", type=int, default=10000, help="Catalogue size, e.g. 1000 to 1000000")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--ops", type=int, default=2000, help="Operations per scenario")
+    ap.add_argument("--preprocess-games", type=int, default=500, help="Games preprocessed by the preprocess scenario")
+    ap.add_argument("--corenlp-delay-ms", type=float, default=0.0, help="Latency added to every stub CoreNLP request")
+    ap.add_argument("--workdir", default=os.path.join(BENCHMARKS, "data"), help="Where generated catalogues are kept")
+    ap.add_argument("--output", default=None, help="File to write the JSON results to")
+    ap.add_argument("--compare", default=None, help="Earlier results file to compare with")
+    args = ap.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS: ap.error(f"unknown scenario {name!r}")
+    missing = missing_nltk_data() if NLTK_SCENARIOS.intersection(args.scenarios or SCENARIOS) else []
+    if missing:
+        sys.exit(f"NLTK data missing: {', '.join(missing)}\nDownload it with: python -m nltk.downloader {' '.join(missing)}")
+
+    main(args)
@@ -0,0 +1,55 @@
+"""
+Startup benchmark: how long GameBot() takes to construct as the catalogue grows.
+Builds synthetic games databases of increasing size and times the first construction (which creates ascii_names and
+normalizes the existing titles once) and the following ones, which should take the same time at every size.
+Usage: python benchmarks/startup.py [sizes...]
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from igdb_scrape import create_tables
+
+def make_db(path, size):
+    """Writes a games database with `size` synthetic games, without ascii_names, like an old scrape would have"""
+    con = sqlite3.connect(path)
+    create_tables(con)
+    con.execute("DROP TABLE ascii_names;")
+    con.executemany("INSERT INTO games (id, name, release_date, summary, story, rating) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((f"game-{i}", f"Gâme Number {i}", 1000000000 + i, "A summary.", "A story.", 75.0) for i in range(size)))
+    con.commit()
+    con.close()
+
+def time_startup(path, repeat=5):
+    from bot import GameBot
+
+    start = time.perf_counter()
+    GameBot(path).con.close()
+    first = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        GameBot(path).con.close()
+        times.append(time.perf_counter() - start)
+
+    return first, statistics.median(times)
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000, 100000]
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = []
+        for size in sizes:
+            path = os.path.join(directory, f"games-{size}.sqlite")
+            make_db(path, size)
+            results.append((size, *time_startup(path)))
+
+    print(f"{'games':>10} {'first start (s)':>16} {'later starts (ms)':>18}")
+    for size, first, later in results:
+        print(f"{size:>10} {first:>16.3f} {later * 1000:>18.2f}")
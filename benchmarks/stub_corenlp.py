@@ -0,0 +1,150 @@
+"""
+Stub CoreNLP server for the benchmarks: answers the CoreNLP HTTP API from recorded annotations, with no Java needed.
+Recordings are JSON lines of {"text": sentence, "sentence": annotated sentence} (see synthetic.py). Requests are split
+into sentences the way utils.py sends them (one per line with ssplit.eolonly, otherwise the whole text), each sentence
+is looked up, and its token offsets and index are shifted to its place in the request. Sentences that weren't recorded
+get a flat parse and are counted as misses. GET /live answers health checks and GET /stats returns the counters.
+Usage: python benchmarks/stub_corenlp.py annotations.jsonl [--port 9000] [--delay-ms MS]
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def load_recordings(path):
+    recordings = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings[entry["text"]] = entry["sentence"]
+    return recordings
+
+def _utf16_len(text):
+    return len(text.encode("utf-16-le")) // 2
+
+def flat_sentence(text):
+    """Annotation of a sentence that wasn't recorded: every token a noun under one fragment"""
+    tokens = []
+    offset = 0
+    for i, word in enumerate(text.split()):
+        offset = text.index(word, offset)
+        begin = _utf16_len(text[:offset])
+        tokens.append({"index": i + 1, "word": word, "originalText": word, "pos": "NN",
+                       "characterOffsetBegin": begin, "characterOffsetEnd": begin + _utf16_len(word)})
+        offset += len(word)
+    leaves = " ".join(f"(NN {token['word'].replace('(', '-LRB-').replace(')', '-RRB-')})" for token in tokens)
+    return {"parse": f"(ROOT (FRAG {leaves}))", "entitymentions": [], "openie": [], "tokens": tokens}
+
+class StubCoreNLPServer:
+    def __init__(self, recordings, port=0, host="127.0.0.1", delay=0.0):
+        """
+        Args:
+            recordings: Map of sentence text to its recorded annotation
+            port: Port to listen on (0 for any free one)
+            delay: Seconds to sleep per request, to stand in for the annotation time of a real server
+        """
+        self.recordings = recordings
+        self.delay = delay
+        self.requests = 0
+        self.sentences = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def annotate(self, text, properties):
+        lines = text.split("\n") if properties.get("ssplit.eolonly") == "true" else [text]
+        sentences = []
+        offset = 0
+        misses = 0
+        for line in lines:
+            stripped = line.strip()
+            if stripped:
+                sentence = self.recordings.get(stripped)
+                if sentence is None:
+                    misses += 1
+                    sentence = flat_sentence(stripped)
+                shift = offset + _utf16_len(line[:len(line) - len(line.lstrip())])
+                tokens = [{**token, "characterOffsetBegin": token["characterOffsetBegin"] + shift,
+                           "characterOffsetEnd": token["characterOffsetEnd"] + shift} for token in sentence["tokens"]]
+                sentences.append({**sentence, "index": len(sentences), "tokens": tokens})
+            offset += _utf16_len(line) + 1
+
+        with self._lock:
+            self.requests += 1
+            self.sentences += len(sentences)
+            self.misses += misses
+        return {"sentences": sentences}
+
+    def stats(self):
+        return {"requests": self.requests, "sentences": self.sentences, "misses": self.misses}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real server
+            disable_nagle_algorithm = True # Headers and body are separate writes
+
+            def _send(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path in ("/live", "/ready"):
+                    self._send(200, b"live", "text/plain")
+                elif path == "/stats":
+                    self._send(200, json.dumps(stub.stats()).encode("utf-8"))
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+            def do_POST(self):
+                query = parse_qs(urlparse(self.path).query)
+                properties = json.loads(query.get("properties", ["{}"])[0])
+                text = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                if stub.delay: time.sleep(stub.delay)
+                self._send(200, json.dumps(stub.annotate(text, properties)).encode("utf-8"))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """Serves from a background thread; returns self"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-corenlp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    ap = ArgumentParser(description="Replays recorded CoreNLP annotations over the CoreNLP HTTP API")
+    ap.add_argument("recordings", help="JSON-lines file of recorded annotations")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--delay-ms", type=float, default=0.0, help="Added latency per request")
+    args = ap.parse_args()
+
+    stub = StubCoreNLPServer(load_recordings(args.recordings), args.port, args.host, args.delay_ms / 1000)
+    print(f"Stub CoreNLP server at {stub.url}; use it with CORENLP_URL={stub.url}")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
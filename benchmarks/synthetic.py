@@ -0,0 +1,214 @@
+"""
+Synthetic games catalogue for the benchmarks.
+Writes a games.sqlite with the scraper's schema: games with summaries and stories, franchises, genres and the relations
+preprocessing would extract from them. Everything is derived from a seed, so a scale and seed always give the same
+database. Optionally also writes CoreNLP annotations of the catalogue's sentences and of the benchmark questions, in the
+JSON-lines format stub_corenlp.py replays ({"text": ..., "sentence": ...} per line).
+Every sentence comes from a template whose parse is known, so the annotations are built here without a CoreNLP server.
+Usage: python benchmarks/synthetic.py games.sqlite [--games N] [--seed S] [--annotations annotations.jsonl]
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from igdb_scrape import create_tables
+from relations import create_relations_table, insert_relations
+from title_index import store_ascii_names
+
+ADJECTIVES = ["Crimson", "Silent", "Eternal", "Hidden", "Broken", "Golden", "Frozen", "Shadow", "Iron", "Lost", "Final",
+              "Savage", "Cosmic", "Ancient", "Neon", "Wild", "Hollow", "Burning", "Pokémon", "Mystic"]
+NOUNS = ["Knight", "Frontier", "Legend", "Odyssey", "Dungeon", "Empire", "Garden", "Horizon", "Protocol", "Saga",
+         "Kingdom", "Voyage", "Arena", "Station", "Citadel", "Requiem", "Island", "Circuit", "Labyrinth", "Tactics"]
+GENRES = ["platform", "puzzle", "racing", "shooter", "strategy", "adventure", "fighting", "simulation", "sport", "arcade"]
+HEROES = ["knight", "pilot", "wizard", "detective", "robot", "princess", "farmer", "ninja", "captain", "thief"]
+VILLAINS = ["dragon", "emperor", "witch", "virus", "pirate", "giant", "demon", "warlord", "swarm", "tyrant"]
+PLACES = ["castle", "desert", "city", "forest", "ocean", "moon", "island", "station", "cave", "valley"]
+VERBS = [("fights", "fight"), ("chases", "chase"), ("rescues", "rescue"), ("defeats", "defeat"), ("explores", "explore")]
+
+RELEASE_START = 315532800 # 1980-01-01
+
+def title_of(index):
+    """Title of the game with the given index; unique for every index"""
+    adjective = ADJECTIVES[index % len(ADJECTIVES)]
+    noun = NOUNS[(index // len(ADJECTIVES)) % len(NOUNS)]
+    number = index // (len(ADJECTIVES) * len(NOUNS))
+    return f"{adjective} {noun}" if number == 0 else f"{adjective} {noun} {number + 1}"
+
+def slug_of(title):
+    return title.lower().replace(" ", "-")
+
+class Sentence:
+    """A templated sentence with its parse"""
+    def __init__(self, tokens, parse):
+        """
+        Args:
+            tokens: List of (word, POS tag) pairs
+            parse: Bracketed parse of the tokens, as CoreNLP prints it
+        """
+        self.tokens = tokens
+        self.parse = parse
+
+    @property
+    def text(self):
+        text = ""
+        for word, tag in self.tokens:
+            text += word if not text or tag in (".", ",") else " " + word
+        return text
+
+    def annotation(self):
+        """The sentence as CoreNLP's JSON output would have it, keeping what utils._compact_sentence keeps"""
+        tokens = []
+        offset = 0
+        for i, (word, tag) in enumerate(self.tokens):
+            if i > 0 and tag not in (".", ","): offset += 1
+            tokens.append({"index": i + 1, "word": word, "originalText": word, "pos": tag,
+                           "characterOffsetBegin": offset, "characterOffsetEnd": offset + len(word)})
+            offset += len(word)
+        return {"parse": self.parse, "entitymentions": [], "openie": [], "tokens": tokens}
+
+def _leaves(tokens):
+    return " ".join(f"({tag} {word})" for word, tag in tokens)
+
+def _title_tokens(title):
+    return [(word, "CD" if word.isdigit() else "NNP") for word in title.split()]
+
+def description_sentence(title, genre):
+    # "<Title> is a <genre> game."
+    title_tokens = _title_tokens(title)
+    tokens = title_tokens + [("is", "VBZ"), ("a", "DT"), (genre, "JJ"), ("game", "NN"), (".", ".")]
+    parse = f"(ROOT (S (NP {_leaves(title_tokens)}) (VP (VBZ is) (NP (DT a) (JJ {genre}) (NN game))) (. .)))"
+    return Sentence(tokens, parse)
+
+def action_sentence(subject, verb, obj):
+    # "The <subject> <verb>s the <object>."
+    tokens = [("The", "DT"), (subject, "NN"), (verb, "VBZ"), ("the", "DT"), (obj, "NN"), (".", ".")]
+    parse = f"(ROOT (S (NP (DT The) (NN {subject})) (VP (VBZ {verb}) (NP (DT the) (NN {obj}))) (. .)))"
+    return Sentence(tokens, parse)
+
+def relation_question(subject, lemma):
+    # "What does the <subject> <verb>?", answered from the relations table
+    tokens = [("What", "WP"), ("does", "VBZ"), ("the", "DT"), (subject, "NN"), (lemma, "VB"), ("?", ".")]
+    parse = f"(ROOT (SBARQ (WHNP (WP What)) (SQ (VBZ does) (NP (DT the) (NN {subject})) (VP (VB {lemma}))) (. ?)))"
+    return Sentence(tokens, parse)
+
+def release_question(title):
+    # "When did <Title> come out?", which the fast path doesn't know
+    title_tokens = _title_tokens(title)
+    tokens = [("When", "WRB"), ("did", "VBD")] + title_tokens + [("come", "VB"), ("out", "RP"), ("?", ".")]
+    parse = f"(ROOT (SBARQ (WHADVP (WRB When)) (SQ (VBD did) (NP {_leaves(title_tokens)}) (VP (VB come) (PRT (RP out)))) (. ?)))"
+    return Sentence(tokens, parse)
+
+def describe_game(rng, index):
+    """Returns (summary sentences, story sentences, relations) of a game"""
+    title = title_of(index)
+    genre = rng.choice(GENRES)
+    hero, villain, place = rng.choice(HEROES), rng.choice(VILLAINS), rng.choice(PLACES)
+    (verb, lemma), (verb2, lemma2) = rng.sample(VERBS, 2)
+
+    summary = [description_sentence(title, genre), action_sentence(hero, verb, villain)]
+    story = [action_sentence(hero, verb2, place)]
+    # What preprocessing extracts from those sentences: the subject loses its determiner, the object keeps it, and the
+    # original phrase is the verb phrase
+    relations = [
+        (title.lower(), "be", f"a {genre} game", f"is a {genre} game"),
+        (hero, lemma, f"the {villain}", f"{verb} the {villain}"),
+        (hero, lemma2, f"the {place}", f"{verb2} the {place}"),
+    ]
+    return summary, story, relations
+
+def questions(games, count=200, seed=0):
+    """Benchmark questions about a catalogue of `games` games, each with its parse"""
+    rng = random.Random(seed)
+    result = []
+    for i in range(count):
+        if i % 2 == 0:
+            result.append(relation_question(rng.choice(HEROES), rng.choice(VERBS)[1]))
+        else:
+            result.append(release_question(title_of(rng.randrange(games))))
+    return result
+
+def generate(path, games=1000, seed=0, annotations=None, annotated_games=2000, with_relations=True, chunk_size=10000):
+    """
+    Writes a synthetic catalogue to path (which must not exist yet)
+    Args:
+        path: Path of the database to create
+        games: Number of games
+        seed: Random seed
+        annotations: Optional path of a JSON-lines file to write annotations to
+        annotated_games: Number of games (the first ones) whose sentences are annotated
+        with_relations: Whether to fill the relations table as if the catalogue had been preprocessed
+        chunk_size: Number of games written per transaction
+    """
+    if os.path.exists(path):
+        raise FileExistsError(path)
+
+    rng = random.Random(seed)
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode = WAL;")
+    con.execute("PRAGMA synchronous = OFF;")
+    create_tables(con)
+    create_relations_table(con.cursor())
+
+    recorded = {}
+    franchise_size = 10
+    for start in range(0, games, chunk_size):
+        game_rows, genre_rows, franchise_rows, in_franchise_rows, relation_rows = [], [], [], [], []
+        for index in range(start, min(games, start + chunk_size)):
+            title = title_of(index)
+            slug = slug_of(title)
+            summary, story, relations = describe_game(rng, index)
+            game_rows.append((slug, title, RELEASE_START + rng.randrange(40 * 365) * 86400, " ".join(s.text for s in summary),
+                              " ".join(s.text for s in story), round(rng.uniform(20, 100), 2), index + 1))
+            genre_rows.append((slug, summary[0].tokens[-3][0]))
+
+            # Consecutive games share a franchise; about half of them are in one
+            if (index // franchise_size) % 2 == 0:
+                franchise = f"franchise-{index // franchise_size}"
+                if index % franchise_size == 0:
+                    franchise_rows.append((franchise, f"{title} Series"))
+                in_franchise_rows.append((slug, franchise))
+
+            if with_relations:
+                relation_rows.extend({"subject": subject, "relation": relation, "object": obj, "original_phrase": phrase,
+                                      "extra": "", "game_id": slug, "franchise_id": None}
+                                     for subject, relation, obj, phrase in relations)
+            if annotations is not None and index < annotated_games:
+                for sentence in summary + story:
+                    recorded[sentence.text] = sentence
+
+        con.executemany("INSERT INTO games (id, name, release_date, summary, story, rating, igdb_id) VALUES (?, ?, ?, ?, ?, ?, ?)", game_rows)
+        store_ascii_names(con, [(row[0], row[1]) for row in game_rows])
+        con.executemany("INSERT OR IGNORE INTO in_genre VALUES (?, ?)", genre_rows)
+        con.executemany("INSERT INTO franchises VALUES (?, ?)", franchise_rows)
+        con.executemany("INSERT INTO in_franchise VALUES (?, ?)", in_franchise_rows)
+        insert_relations(con.cursor(), relation_rows)
+        con.commit()
+
+    con.execute("ANALYZE;")
+    con.commit()
+    con.close()
+
+    if annotations is not None:
+        for sentence in questions(games):
+            recorded[sentence.text] = sentence
+        with open(annotations, "w", encoding="utf-8") as f:
+            for text, sentence in recorded.items():
+                f.write(json.dumps({"text": text, "sentence": sentence.annotation()}) + "\n")
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    ap = ArgumentParser(description="Generates a synthetic games database for the benchmarks")
+    ap.add_argument("path", help="Database to create")
+    ap.add_argument("--games", type=int, default=1000, help="Number of games (e.g. 1000 to 1000000)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--annotations", default=None, help="Also write CoreNLP annotations for stub_corenlp.py to this file")
+    ap.add_argument("--annotated-games", type=int, default=2000, help="Number of games whose sentences are annotated")
+    ap.add_argument("--no-relations", action="store_true", help="Leave the relations table empty, as before preprocessing")
+    args = ap.parse_args()
+
+    generate(args.path, args.games, args.seed, args.annotations, args.annotated_games, not args.no_relations)
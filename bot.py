@@ -12,16 +12,63 @@ from nltk import sent_tokenize, word_tokenize, pos_tag
 import sqlite3
 
 import datetime
+from collections import Counter
 
-from utils import advanced_parse, preprocess_db, find_node_by_tag, detokenize, capitalize_all, conjugate,\
-    remove_tag, and_join, normalize_encoding, collect_relations, wnl
+from corenlp import start_parsers
+from utils import advanced_parse, preprocess_db, preprocess_db_parallel, preprocess_db_streaming, preprocess_changed, find_node_by_tag, capitalize_all, conjugate,\
+    node_text, and_join, collect_relations, enable_annotation_cache, wnl
+from tree_index import index_tree
+from title_index import ensure_ascii_names, ensure_title_index, normalize_title, search_titles
+from fuzzy import FuzzyTitleMatcher
+from relations import create_relations_table, find_relations, forget_subjects, insert_relations, sample_relation
+from intents import match_intent, title_options
+from answer_cache import AnswerCache
+import metrics
+import repository
+import storage
+
+def _set_metadata(cur, key, value):
+    cur.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", (key, value))
+
+class Answer:
+    """The response to a line of user input"""
+    def __init__(self, lines, result, cached=False):
+        self.lines = lines # Lines of text shown to the user
+        self.result = result # What GameBot.process returned: True, a message, None for invalid input
+        self.cached = cached
+    
+    def messages(self):
+        """All the text for the user, including the message GameBot.loop would print for the result"""
+        if self.result is None:
+            return self.lines + ["Invalid input; please try again."]
+        if isinstance(self.result, str):
+            return self.lines + [self.result]
+        return list(self.lines)
 
 class GameBot:
-    def __init__(self, db_path="games.sqlite"):
+    def __init__(self, db_path="games.sqlite", interactive=True, writer=None, title_matcher=None):
+        """
+        Args:
+            db_path: Path of the games database
+            interactive: Console mode: print answers and use the username stored in the database. Otherwise answers
+                         are only returned by respond, and the caller sets the username of each conversation
+            writer: Optional storage.GroupCommitWriter shared by several bots; without one, writes commit directly
+            title_matcher: Optional fuzzy.FuzzyTitleMatcher shared by several bots; without one, the bot builds its own
+        """
         self.con = sqlite3.connect(db_path)
+        storage.configure(self.con)
+        metrics.watch(self.con)
         self.cur = self.con.cursor()
+        self.writer = writer
+        self.echo = interactive
+        self.title_matcher = title_matcher # Built on the first fuzzy lookup if not shared
+        self.path_counts = Counter() # How many lines each path of process answered
+        self.answer_cache = AnswerCache()
+        self._output = None # Lines emitted while answering, for the answer cache
+        self._reads = set() # Groups of tables read while answering
+        self._cacheable = False
         self.prepare_state()
-        self.username = self.fetch_username()
+        self.username = self.fetch_username() if interactive else None
     
     def prepare_state(self):
         self.cur.execute("CREATE TABLE IF NOT EXISTS metadata ("
@@ -29,52 +76,88 @@ class GameBot:
                          "  value TEXT NOT NULL"
                          ");")
 
-        self.cur.execute("CREATE TABLE IF NOT EXISTS ascii_names ("
-                         "  game_id TEXT NOT NULL PRIMARY KEY,"
-                         "  value TEXT NOT NULL,"
-                         "  FOREIGN KEY(game_id) REFERENCES games(id)"
-                         ");")
-        rows = []
-        for game in self.cur.execute("SELECT * FROM games WHERE id NOT IN (SELECT game_id FROM ascii_names)"):
-            rows.append((game[0], normalize_encoding(game[1])))
+        # Kept up to date as games are scraped, so there's nothing to scan here
+        ensure_ascii_names(self.con)
+        ensure_title_index(self.con)
         
-        if rows:
-            self.cur.executemany("INSERT OR REPLACE INTO ascii_names (game_id, value) VALUES(?, ?)", rows)
-            self.con.commit()
+        create_relations_table(self.cur)
+        repository.ensure_indexes(self.cur)
+        self.con.commit()
 
-    def preprocess_facts(self):
+    def preprocess_facts(self, workers=1, streaming=False, **kwargs):
+        if streaming:
+            parsers = start_parsers(workers) if workers > 1 else None
+            # Games changed by a delta sync first, then the ones never processed
+            preprocess_changed(self.con, self.cur, parsers=parsers)
+            return preprocess_db_streaming(self.con, self.cur, parsers=parsers, **kwargs)
+        
         start = next(iter(self.cur.execute("SELECT value FROM metadata_numbers WHERE key = 'bot_preprocess_offset'")), (0,))[0]
-        preprocess_db(self.con, self.cur, start=start)
+        if workers > 1:
+            return preprocess_db_parallel(self.con, self.cur, start=start, workers=workers, **kwargs)
+        preprocess_db(self.con, self.cur, start=start, **kwargs)
+    
+    @metrics.timed("write")
+    def write(self, fn, *args):
+        """Runs fn(cursor, *args) and commits, through the group-commit writer if there is one"""
+        if self.writer is not None:
+            return self.writer.submit(fn, *args).result()
+        
+        try:
+            result = fn(self.cur, *args)
+            self.con.commit()
+        except sqlite3.Error:
+            self.con.rollback()
+            raise
+        return result
     
     def set(self, key : str, value : str):
         # Sets a fact about the current state
-        self.cur.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", (key, value))
-        self.con.commit()
+        self.write(_set_metadata, key, value)
     
     def get(self, key : str, default=None):
         return next(iter(self.cur.execute("SELECT value FROM metadata WHERE key = ?", (key,))), (default,))[0]
     
-    def find_games(self, *descriptors):
-        for base_descriptor in descriptors:
-            if isinstance(base_descriptor, nltk.tree.Tree):
-                descs = [detokenize(base_descriptor.leaves())]
-                other = remove_tag(base_descriptor, ("PP", "POS"), recursive=True)
-                if other != base_descriptor: descs.append(detokenize(other.leaves()))
-                other = find_node_by_tag(base_descriptor, "NNP", recursive=True) # Hack to find proper nouns
-                if other is not None and other != base_descriptor: descs.append(detokenize(other.leaves()))
-            else:
-                descs = [base_descriptor]
+    def _descriptor_options(self, base_descriptor):
+        if isinstance(base_descriptor, nltk.tree.Tree):
+            descs = [node_text(base_descriptor)]
+            other = node_text(base_descriptor, ("PP", "POS"), recursive=True)
+            if other != descs[0]: descs.append(other)
+            other = find_node_by_tag(base_descriptor, "NNP", recursive=True) # Hack to find proper nouns
+            if other is not None and other is not base_descriptor: descs.append(node_text(other))
+        else:
+            descs = [base_descriptor]
+        
+        return descs
+    
+    @metrics.timed("find_games")
+    def find_games(self, *descriptors, fuzzy=True):
+        descs = [descriptor for base_descriptor in descriptors for descriptor in self._descriptor_options(base_descriptor)]
+        
+        for descriptor in descs:
+            # print("Looking for", repr(descriptor))
+            # Exact title matches if there are any, otherwise prefix and substring matches ranked by relevance
+            result = search_titles(self.cur, descriptor)
             
-            for descriptor in descs:
-                # print("Looking for", repr(descriptor))
-                result = list(self.cur.execute("SELECT * FROM games WHERE id IN (SELECT game_id FROM ascii_names WHERE value LIKE ?)", (descriptor,)))
-                
-                if len(result) > 0: return result
-                
-                res = self.cur.execute("SELECT * FROM games WHERE id IN (SELECT game_id FROM ascii_names WHERE value LIKE ?)", ('%' + descriptor + '%',))
-                result.extend(res)
-                
-                if len(result) > 0: return result
+            if len(result) > 0: return result
+        
+        if fuzzy:
+            # Nothing matched literally; the title might be misspelled
+            return self.find_games_fuzzy(*descs)
+        
+        return []
+    
+    @metrics.timed("find_games_fuzzy")
+    def find_games_fuzzy(self, *descriptors, min_score=0.75):
+        if self.title_matcher is None:
+            self.title_matcher = FuzzyTitleMatcher()
+        self.title_matcher.refresh(self.cur) # Picks up newly scraped games
+        
+        for descriptor in descriptors:
+            matches = self.title_matcher.search(normalize_title(descriptor), min_score=min_score)
+            if not matches: continue
+            
+            best = [game_id for score, game_id, title in matches if score == matches[0][0]]
+            return repository.games_by_ids(self.cur, best)
         
         return []
     
@@ -82,39 +165,115 @@ class GameBot:
         return next(iter(self.find_games(*args, **kwargs)), None)
     
     def get_part_of_franchises(self, game_id):
-        franchises = []
-        
-        for (franch_id,) in self.cur.execute("SELECT franchise_id FROM in_franchise WHERE game_id = ?", (game_id,)):
-            franchises.extend(self.cur.execute("SELECT * FROM franchises WHERE id = ?", (franch_id,)))
-        
-        return franchises
+        return repository.franchises_of_games(self.cur, [game_id])[game_id]
     
     def find_relations(self, **kwargs):
-        return self._find_relations("=", **kwargs)
+        return self._find_relations(False, **kwargs)
     
     def find_relations_like(self, **kwargs):
-        return self._find_relations(" LIKE ", **kwargs)
+        return self._find_relations(True, **kwargs)
     
-    def _find_relations(self, eq, **kwargs):
+    @metrics.timed("find_relations")
+    def _find_relations(self, like, **kwargs):
         if len(kwargs) == 0: return []
+        self._reads.add("relations")
         
         if kwargs.get("subject"):
             if wnl.lemmatize(kwargs["subject"].lower(), "n") in ("i", "me"):
                 kwargs["subject"] = self.username
         
-        key_values = list(kwargs.items())
-        
-        query = "SELECT * FROM relations WHERE " + " AND ".join(key + eq + "?" for key, _ in key_values) + ";"
-        return list(self.cur.execute(query, tuple(value for _, value in key_values)))
+        return find_relations(self.cur, like, **kwargs)
     
-    def get_random_fact(self):
-        row = next(iter(self.cur.execute("SELECT * FROM relations ORDER BY RANDOM() LIMIT 1;")))
-        return row
+    def get_random_fact(self, game_only=False, franchise_id=None):
+        return sample_relation(self.cur, game_only=game_only, franchise_id=franchise_id)
+    
+    def find_franchise(self, name):
+        return repository.find_franchise(self.cur, name)
     
     def find_game_by_id(self, game_id):
         if game_id == "reality": return ("reality", "Reality", 0, "A stand-in game for reality", "You exist. That's the story.", 100)
-        return next(iter(self.cur.execute("SELECT * FROM games WHERE id = ?", (game_id,))), None)
+        return repository.game_by_id(self.cur, game_id)
+    
+    def tell_fact(self, franchise=None):
+        fact = self.get_random_fact(franchise_id=franchise[0] if franchise is not None else None)
+        if fact is None:
+            self.emit("I don't know anything about that yet.")
+            return True
+        
+        predicate = conjugate(fact[1], fact[0])
+        self.emit(f"Did you know: {fact[0].capitalize()} {predicate} {fact[2]}?")
+        self.emit(f"Related to game: {self.find_game_by_id(fact[-2])[1]}")
+        return True
+    
+    def answer_release(self, games):
+        results = []
+        for game in games:
+            title = capitalize_all(game[1])
+            
+            if game[2] is not None:
+                results.append(f"{title} was released on {datetime.date.fromtimestamp(game[2])}")
+            else:
+                results.append(f"I don't know when {title} was released")
+        return results
+    
+    def answer_rating(self, games):
+        return [f"{game[1]} is rated {game[5]}" for game in games]
     
+    def answer_story(self, games):
+        return [f"The story of {game[1]} is: {game[4]}" for game in games]
+    
+    def answer_description(self, games):
+        return [f"The description of {game[1]} is: {game[3]}" for game in games]
+    
+    def answer_franchises(self, games):
+        results = []
+        franchises_of = repository.franchises_of_games(self.cur, [game[0] for game in games])
+        for game in games:
+            franchises = franchises_of[game[0]]
+            
+            results.append(
+                f"{capitalize_all(game[1])} is part of the following franchises:\n" + \
+                and_join(capitalize_all(franchise[1]) for franchise in franchises)
+            )
+        return results
+    
+    def emit(self, text):
+        """Shows a line of the answer to the user"""
+        if self.echo:
+            print(text)
+        if self._output is not None:
+            self._output.append(text)
+    
+    @metrics.timed("print_results")
+    def print_results(self, results):
+        if len(results) == 0:
+            self.emit("I'm afraid that I don't know much about that.")
+        else:
+            self.emit(f"{len(results)} responses matched your query:")
+            for result in results:
+                if isinstance(result, str):
+                    self.emit(result)
+                else:
+                    self.emit(pprint.pformat(result))
+    
+    def answer_fast(self, line):
+        """Answers templated questions without parsing them; returns None if the line needs the full parse"""
+        match = match_intent(line)
+        if match is None: return None
+        intent, title = match
+        
+        if intent == "fact":
+            return self.tell_fact(self.find_franchise(title) if title else None)
+        
+        games = self.find_games(*title_options(title))
+        if not games: return None # Maybe the parser's entities find it
+        
+        self._cacheable = True
+        
+        self.print_results(self.INTENT_ANSWERS[intent](self, games))
+        return True
+    
+    @metrics.timed("process_statement")
     def process_statement(self, tree, sent):
         # Try to process it as a command
         vp = find_node_by_tag(tree, "VP") or tree
@@ -137,24 +296,27 @@ class GameBot:
         
         if subject is not None:
             # Fact
-            subject_word = detokenize(subject.leaves()).lower()
+            subject_word = node_text(subject).lower()
             subject_lemma = wnl.lemmatize(subject_word, "n")
         
         if command is not None:
-            command_lemma = wnl.lemmatize(detokenize(command.leaves()).lower())
+            command_lemma = wnl.lemmatize(node_text(command).lower())
             # print("Command received:")
             # print(command_lemma, to, what)
             
             if what is not None and to is not None:
-                what_lemma = wnl.lemmatize(detokenize(what.leaves()).lower())
-                to_lemma = wnl.lemmatize(detokenize(to.leaves()).lower())
+                what_lemma = wnl.lemmatize(node_text(what).lower())
+                to_lemma = wnl.lemmatize(node_text(to).lower())
                 
                 if command_lemma in ("tell", "give") and to_lemma in ("me", "I") and "something" in what_lemma:
-                    fact = self.get_random_fact()
-                    predicate = conjugate(fact[1], fact[0])
-                    print(f"Did you know: {fact[0].capitalize()} {predicate} {fact[2]}?")
-                    print(f"Related to game: {self.find_game_by_id(fact[-2])[1]}")
-                    return True
+                    # "Tell me something about <franchise>" narrows it down to that franchise's games
+                    franchise = None
+                    about = find_node_by_tag(what, "PP", recursive=True)
+                    about = find_node_by_tag(about, "NP") if about is not None else None
+                    if about is not None:
+                        franchise = self.find_franchise(node_text(about, "DT"))
+                    
+                    return self.tell_fact(franchise)
             
             if subject is not None:
                 if command_lemma == "forget":
@@ -163,15 +325,14 @@ class GameBot:
                     options = [subject_lemma]
                     
                     try:
-                        other = detokenize(remove_tag(subject, "DT").leaves()).lower()
+                        other = node_text(subject, "DT").lower()
                         if subject_lemma != other: options.append(other)
                     except Exception as e:
                         pass
                     
-                    for option in options:
-                        self.cur.execute("DELETE FROM relations WHERE subject LIKE ?;", (option,))
-                    self.con.commit()
-                    print(f"I've removed everything related to {subject_lemma}.")
+                    self.write(forget_subjects, options)
+                    self.answer_cache.invalidate("relations")
+                    self.emit(f"I've removed everything related to {subject_lemma}.")
                     return True
         
         if subject is not None:
@@ -181,7 +342,8 @@ class GameBot:
                 # print(tree, subject_lemma)
                 if subject_lemma in ("i", "me"): subject_lemma = self.username
                 
-                relations = collect_relations(sent, subject_lemma)
+                with metrics.span("collect_relations"):
+                    relations = collect_relations(sent, subject_lemma)
                 relations = [
                     {**relation, "game_id": "reality", "franchise_id": None} for relation in relations
                 ]
@@ -192,12 +354,10 @@ class GameBot:
                 
                 # print(relations)
                 if relations:
-                    self.cur.executemany("INSERT OR REPLACE INTO relations (subject, relation, object, extra, original_phrase, game_id, franchise_id) "
-                                         "VALUES(:subject, :relation, :object, :extra, :original_phrase, :game_id, :franchise_id)",
-                                         relations)
-                    self.con.commit()
+                    self.write(insert_relations, relations)
+                    self.answer_cache.invalidate("relations")
                     
-                    print("I'll remember that!")
+                    self.emit("I'll remember that!")
                     return True
             #else:
             #    return f"I'm afraid that I don't record facts about {subject_word}."
@@ -206,7 +366,43 @@ class GameBot:
     
     def process(self, line):
         """Processes the line of user input"""
-        tree, entities, openie, tokens = advanced_parse(line)
+        return self.respond(line).result
+    
+    def respond(self, line):
+        """Processes the line of user input, answering repeated questions from the answer cache; returns an Answer"""
+        # "I" and "me" mean the current user
+        key = (" ".join(line.casefold().split()), self.username)
+        with metrics.turn(user=self.username):
+            cached = self.answer_cache.get(key, self.con)
+            if cached is not None:
+                metrics.count("path.cached")
+                output, result = cached
+                for text in output:
+                    if self.echo: print(text)
+                return Answer(list(output), result, cached=True)
+            
+            self._output, self._reads, self._cacheable = [], {"games"}, False
+            try:
+                result = self._process(line)
+                if self._cacheable:
+                    self.answer_cache.put(key, (self._output, result), self._reads)
+                return Answer(self._output, result)
+            finally:
+                self._output = None
+    
+    def _process(self, line):
+        with metrics.span("answer_fast"):
+            result = self.answer_fast(line)
+        if result is not None:
+            self.path_counts["fast"] += 1
+            metrics.count("path.fast")
+            return result
+        self.path_counts["corenlp"] += 1
+        metrics.count("path.corenlp")
+        
+        with metrics.span("parse"):
+            tree, entities, openie, tokens = advanced_parse(line)
+            tree = index_tree(tree) # Answers the find_node_by_tag probes below without walking the tree again
         
         # print("Entities:")
         # pprint.pprint(entities)
@@ -223,18 +419,21 @@ class GameBot:
             #       I could have game id = 0 for "reality."
             return self.process_statement(tree, line)
         
+        # Questions only read, so their answers can be reused until the data changes
+        self._cacheable = True
+        
         punct = find_node_by_tag(tree, ".")
-        if punct is None or detokenize(punct.leaves()) != "?":
+        if punct is None or node_text(punct) != "?":
             return "Are you sure that's a question? Questions usually end with question marks, don't they?"
         
         question_phrase = find_node_by_tag(tree, ("WHNP", "WHADVP"))
         if question_phrase is None: return "No question word found"
         
-        question = find_node_by_tag(question_phrase, lambda tag: tag.startswith("W"))
-        question_object = find_node_by_tag(question_phrase, lambda tag: tag.startswith("N"), recursive=True)
-        question_object_lemma = wnl.lemmatize(detokenize(question_object.leaves()).lower(), "n") if question_object is not None else None
+        question = find_node_by_tag(question_phrase, "W*")
+        question_object = find_node_by_tag(question_phrase, "N*", recursive=True)
+        question_object_lemma = wnl.lemmatize(node_text(question_object).lower(), "n") if question_object is not None else None
         
-        question = detokenize(question.leaves()).lower()
+        question = node_text(question).lower()
         
         if question not in ("what", "which", "who", "how", "when"): #"when"
             return f"\"{question}\" is not supported"
@@ -246,12 +445,12 @@ class GameBot:
         
         i = 1
         while True:
-            vb = find_node_by_tag(query, lambda label: label.startswith("VB"), which=i, recursive=True)
+            vb = find_node_by_tag(query, "VB*", which=i, recursive=True)
             
             if vb is None:
                 return "Your question doesn't appear to be complete"
             
-            predicate = detokenize(vb.leaves()).lower()
+            predicate = node_text(vb).lower()
             predicate_lemma = wnl.lemmatize(predicate, "v")
             
             if predicate_lemma == "do":
@@ -265,7 +464,7 @@ class GameBot:
         if np is None:
             return "Couldn't find what you're asking about"
         
-        np_word = detokenize(np.leaves())
+        np_word = node_text(np)
 
         parsed_entities = [entity["text"] for entity in entities if entity["ner"] in ("PERSON", "LOCATION")]
         games = self.find_games(np, *parsed_entities)
@@ -279,29 +478,20 @@ class GameBot:
             # Check release date
             particle = find_node_by_tag(query, "VBN", recursive=True)
             
-            if particle is not None and wnl.lemmatize(detokenize(particle.leaves()).lower(), "v") == "release":
+            if particle is not None and wnl.lemmatize(node_text(particle).lower(), "v") == "release":
                 if not games: return f"I couldn't find any game called {np_word}"
                 
-                for game in games:
-                    title = capitalize_all(game[1])
-                    
-                    if game[2] is not None:
-                        results.append(f"{title} was released on {datetime.date.fromtimestamp(game[2])}")
-                    else:
-                        results.append(f"I don't know when {title} was released")
+                results.extend(self.answer_release(games))
         elif question in ("how",):
             if game is None:
                 return f"I couldn't find any game called {np_word}"
             
             if predicate_lemma == "be":
-                ind = find_node_by_tag(query, (lambda tag: tag.startswith("V")), which=2)
-                ind_lemma = None if ind is None else wnl.lemmatize(detokenize(ind.leaves()).lower(), "v")
+                ind = find_node_by_tag(query, "V*", which=2)
+                ind_lemma = None if ind is None else wnl.lemmatize(node_text(ind).lower(), "v")
                 # print("HOWBE", query, ind, ind_lemma)
                 if ind_lemma == "rat":
-                    for game in games:
-                        results.append(
-                            f"{game[1]} is rated {game[5]}"
-                        )
+                    results.extend(self.answer_rating(games))
             
             if not results:
                 results = self.find_relations_like(subject="there", relation="be", game_id=game[0])
@@ -318,37 +508,22 @@ class GameBot:
                         if game is None:
                             results.append(f"I couldn't find a game by that name: {np_word}")
                         else:
-                            for game in games:
-                                franchises = self.get_part_of_franchises(game[0])
-                                
-                                results.append(
-                                    f"{capitalize_all(game[1])} is part of the following franchises:\n" + \
-                                    and_join(capitalize_all(franchise[1]) for franchise in franchises)
-                                )
+                            results.extend(self.answer_franchises(games))
                     elif question_object_lemma == "story":
                         if game is None:
                             results.append(f"I couldn't find a game by that name: {np_word}")
                         else:
-                            for game in games:
-                                results.append(
-                                    f"The story of {game[1]} is: {game[4]}"
-                                )
+                            results.extend(self.answer_story(games))
                     elif question_object_lemma == "description":
                         if game is None:
                             results.append(f"I couldn't find a game by that name: {np_word}")
                         else:
-                            for game in games:
-                                results.append(
-                                    f"The description of {game[1]} is: {game[3]}"
-                                )
+                            results.extend(self.answer_description(games))
                     elif question_object_lemma == "rating":
                         if game is None:
                             results.append(f"I couldn't find a game by that name: {np_word}")
                         else:
-                            for game in games:
-                                results.append(
-                                    f"{game[1]} is rated {game[5]}"
-                                )
+                            results.extend(self.answer_rating(games))
                     elif question_object_lemma == "game":
                         # Example: What [games] are in the Minecraft franchise?
                         pass
@@ -356,7 +531,7 @@ class GameBot:
             if len(results) == 0:
                 # Fallback
                 options = [np_word]
-                other = detokenize(remove_tag(np, "DT").leaves()).lower()
+                other = node_text(np, "DT").lower()
                 if np_word != other: options.append(other)
                 
                 for options in options:
@@ -370,20 +545,18 @@ class GameBot:
         #if results:
         #    self.set("last_game", str(results[-1][-2]))
 
-        if len(results) == 0:
-            print("I'm afraid that I don't know much about that.")
-        else:
-            print(f"{len(results)} responses matched your query:")
-            for result in results:
-                if isinstance(result, str):
-                    print(result)
-                else:
-                    pprint.pprint(result)
-        
-        self.con.commit()
+        self.print_results(results)
         
         return True
     
+    INTENT_ANSWERS = {
+        "release": answer_release,
+        "rating": answer_rating,
+        "story": answer_story,
+        "description": answer_description,
+        "franchise": answer_franchises
+    }
+    
     def fetch_username(self):
         username = next(iter(self.cur.execute("SELECT value FROM metadata WHERE key = 'username';")), (None,))[0]
         if username:
@@ -406,8 +579,7 @@ class GameBot:
                     self.username = username.lower()
                     print(f"Username selected: {capitalize_all(self.username)}")
                     print("Type \"logout\" to log out.")
-                    self.cur.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('username', ?)", (self.username,))
-                    self.con.commit()
+                    self.set("username", self.username)
     
     def prompt(self):
         self.ensure_username()
@@ -447,8 +619,15 @@ class GameBot:
                     print(result)
 
 if __name__ == "__main__":
+    if "cache" in sys.argv: enable_annotation_cache()
+    if "metrics" in sys.argv: metrics.enable("metrics.jsonl") # One JSON line of stage timings per answered line
     bot = GameBot()
     # bot.preprocess_facts()
+    if "preprocess" in sys.argv:
+        # Unattended (e.g. cron) preprocessing; safe to kill and rerun
+        bot.preprocess_facts(streaming=True)
+        metrics.dump()
+        sys.exit(0)
     if "interact" in sys.argv: code.interact(local=locals())
     bot.loop()
     
@@ -0,0 +1,137 @@
+"""
+A small persistent key-value cache stored in a local SQLite file.
+Values are JSON-serializable objects, stored zlib-compressed. The cache is bounded by the total size of the stored
+values and evicts the least recently used entries first; entries can also expire a fixed time after they were stored.
+"""
+import atexit
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+def make_key(*parts):
+    """Hashes the given JSON-serializable parts into a cache key"""
+    return hashlib.sha256(json.dumps(parts, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class PersistentCache:
+    """SQLite-backed LRU cache with hit/miss counters"""
+    def __init__(self, path, max_bytes=256 * 2**20, commit_every=64, ttl=None):
+        """
+        Opens (or creates) a cache
+        Args:
+            path: Path of the SQLite file
+            max_bytes: Maximum total size of the compressed values before old entries get evicted
+            commit_every: Number of writes between commits
+            ttl: Seconds after which stored entries expire (None to keep them until they get evicted)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock() # The cache may be shared by worker threads
+        self._pending = 0
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "  key TEXT NOT NULL PRIMARY KEY,"
+                         "  value BLOB NOT NULL,"
+                         "  size INTEGER NOT NULL,"
+                         "  last_used INTEGER NOT NULL,"
+                         "  created INTEGER NOT NULL DEFAULT 0"
+                         ");")
+        columns = {row[1] for row in self.con.execute("PRAGMA table_info(entries);")}
+        if "created" not in columns:
+            self.con.execute("ALTER TABLE entries ADD COLUMN created INTEGER NOT NULL DEFAULT 0;")
+        self.con.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);")
+        self.con.commit()
+
+        self._tick, self._bytes = self.con.execute("SELECT COALESCE(MAX(last_used), 0), COALESCE(SUM(size), 0) FROM entries;").fetchone()
+        atexit.register(self.close)
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self.con.execute("SELECT value, created, size FROM entries WHERE key = ?;", (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] < time.time() - self.ttl:
+                self.con.execute("DELETE FROM entries WHERE key = ?;", (key,))
+                self._bytes -= row[2]
+                self.expirations += 1
+                self._written()
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._tick += 1
+            self.con.execute("UPDATE entries SET last_used = ? WHERE key = ?;", (self._tick, key))
+            self._written()
+
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, value):
+        blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+        with self._lock:
+            old = self.con.execute("SELECT size FROM entries WHERE key = ?;", (key,)).fetchone()
+            if old is not None:
+                self._bytes -= old[0]
+
+            self._tick += 1
+            self.con.execute("INSERT OR REPLACE INTO entries (key, value, size, last_used, created) VALUES (?, ?, ?, ?, ?);",
+                             (key, blob, len(blob), self._tick, int(time.time())))
+            self._bytes += len(blob)
+
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._written()
+
+    def _evict(self):
+        # Evict down to 90% of the limit so that we don't evict on every single put
+        target = self.max_bytes * 0.9
+        while self._bytes > target:
+            rows = self.con.execute("SELECT key, size FROM entries ORDER BY last_used LIMIT 256;").fetchall()
+            if not rows: break
+
+            for key, size in rows:
+                if self._bytes <= target: break
+                self.con.execute("DELETE FROM entries WHERE key = ?;", (key,))
+                self._bytes -= size
+                self.evictions += 1
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.con.commit()
+            self._pending = 0
+
+    def flush(self):
+        with self._lock:
+            self.con.commit()
+            self._pending = 0
+
+    def close(self):
+        try:
+            self.flush()
+        except sqlite3.ProgrammingError:
+            pass # Already closed
+
+    def stats(self):
+        with self._lock:
+            entries = self.con.execute("SELECT COUNT(*) FROM entries;").fetchone()[0]
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": entries,
+            "bytes": self._bytes
+        }
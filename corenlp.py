@@ -1,11 +1,10 @@
 # A test script that runs the input through CoreNLP through NLTK
 
-import atexit, sys, os, code
+import atexit, sys, os, code, socket, threading
+import requests
 from nltk.parse.corenlp import CoreNLPServer, CoreNLPParser
 from nltk import word_tokenize
 
-print("Loading CoreNLP Server...")
-
 config_file = "corenlp.pth"
 if not os.path.isfile(config_file):
     warning_msg = f"Warning: {config_file} does not exist. Hopefully, the required jarfiles for Stanford CoreNLP are in the path. " + \
@@ -19,17 +18,154 @@ else:
         corenlp_server = f.readline().strip()
         corenlp_models = f.readline().strip()
 
+# Used to tell apart annotations made by different CoreNLP releases (e.g. in the annotation cache)
+corenlp_version = os.path.basename(corenlp_server) if corenlp_server else "unknown"
+
 corenlp_options = ["-preload", "tokenize,ssplit,pos,lemma,parse,depparse,ner,openie"]
 
-server = CoreNLPServer(corenlp_server, corenlp_models, corenlp_options=corenlp_options)
-server.start() #(open("stdout.log", "wb"), open("stderr.log", "wb"))
-atexit.register(server.stop)
+# URL of an already running server to use instead of starting one, e.g. from `python corenlp.py serve`
+corenlp_url = os.environ.get("CORENLP_URL")
+
+# First port start_parsers tries for its servers
+parser_base_port = int(os.environ.get("CORENLP_BASE_PORT", 9001))
+
+def free_port(start, taken=()):
+    """First port from start on that can be bound (and isn't in taken)"""
+    for port in range(start, 65536):
+        if port in taken: continue
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            try:
+                probe.bind(("", port))
+            except OSError:
+                continue
+        return port
+    raise OSError(f"No free port from {start} on")
+
+def start_server(port=None):
+    """Starts a CoreNLP server (on the given port, or the first free one from 9000) that is stopped at exit"""
+    print("Loading CoreNLP Server...")
+    new_server = CoreNLPServer(corenlp_server, corenlp_models, corenlp_options=list(corenlp_options), port=port)
+    new_server.start() #(open("stdout.log", "wb"), open("stderr.log", "wb"))
+    atexit.register(new_server.stop)
+    return new_server
+
+def is_live(url, timeout=2):
+    """Health check: whether the server at url answers on /live within timeout seconds"""
+    try:
+        return requests.get(url.rstrip("/") + "/live", timeout=timeout).ok
+    except requests.RequestException:
+        return False
+
+def warm_up(nlp):
+    """Sends a small request through every preloaded annotator, so that the first real request isn't the slow one"""
+    nlp.api_call("Mario jumps over the pipe.", {"annotators": corenlp_options[1]}, timeout=300)
+
+class ManagedParser(CoreNLPParser):
+    """
+    CoreNLPParser that recovers from a dead server.
+    When a call can't reach the server, the server is health-checked and, if we started it, restarted, and the call is
+    retried once. Calls share the parser's keep-alive session.
+    """
+    def __init__(self, url, server=None, port=None):
+        """
+        Args:
+            url: URL of the server
+            server: The CoreNLPServer if we started it, so that it can be restarted; None for attached servers
+            port: Port to restart the server on (None for the first free one)
+        """
+        super().__init__(url)
+        self.server = server
+        self.port = port
+        self._lock = threading.Lock()
+
+    def api_call(self, data, properties=None, timeout=60):
+        try:
+            return super().api_call(data, properties, timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if not self.restart_if_dead(): raise
+            return super().api_call(data, properties, timeout)
+
+    def restart_if_dead(self):
+        """Restarts the server if it fails its health check; returns whether it was restarted"""
+        with self._lock:
+            if self.server is None or is_live(self.url): return False
+
+            print("CoreNLP server failed its health check; restarting it", file=sys.stderr)
+            try:
+                self.server.stop()
+            except Exception:
+                pass # Already dead
+            # Something else may have taken the port since
+            self.server = start_server(None if self.port is None else free_port(self.port))
+            self.url = self.server.url
+            self.session = requests.Session()
+            warm_up(self)
+            return True
+
+_parser = None
+_parser_lock = threading.Lock()
+
+def attach(url):
+    """Uses the already running server at url from now on; returns its parser"""
+    global _parser
+    if not is_live(url, timeout=5):
+        raise ConnectionError(f"No live CoreNLP server at {url}")
+    with _parser_lock:
+        _parser = ManagedParser(url)
+    return _parser
+
+def get_parser():
+    """
+    Returns the shared parser, attaching to corenlp_url or starting a server on first use
+    Importing this module doesn't start anything, so only the code that actually needs CoreNLP pays for the JVM.
+    """
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            if corenlp_url and is_live(corenlp_url, timeout=5):
+                _parser = ManagedParser(corenlp_url)
+            else:
+                if corenlp_url:
+                    print(f"No live CoreNLP server at {corenlp_url}; starting one", file=sys.stderr)
+                new_server = start_server()
+                _parser = ManagedParser(new_server.url, new_server)
+            warm_up(_parser)
+    return _parser
+
+def start_parsers(count, base_port=None):
+    """
+    Starts `count` additional CoreNLP servers for parallel processing, on the first free ports from base_port
+    (parser_base_port, set with CORENLP_BASE_PORT, by default).
+    Each server is a separate JVM with its own models loaded, so make sure there is enough memory for all of them.
+    Returns a list of CoreNLPParsers, one per server.
+    """
+    ports = []
+    for i in range(count):
+        ports.append(free_port(parser_base_port if base_port is None else base_port, ports))
+    servers = [start_server(port) for port in ports]
+    parsers = [ManagedParser(new_server.url, new_server, port) for port, new_server in zip(ports, servers)]
+    for nlp in parsers:
+        warm_up(nlp)
+    return parsers
 
-parser = CoreNLPParser(server.url)
+def __getattr__(name):
+    # `parser` and `server` used to be created at import
+    if name == "parser":
+        return get_parser()
+    if name == "server":
+        return get_parser().server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # item = list(parser.parse(word_tokenize("The end of the world is upon us, and Mario Kart 3 won't help.")))[0]
 
 if __name__ == "__main__":
+    if 'serve' in sys.argv:
+        # Keeps a warm server up for other processes: CORENLP_URL=<url> python bot.py
+        parser = get_parser()
+        print(f"CoreNLP server live at {parser.url}; press Enter to stop it")
+        input()
+        sys.exit(0)
+    parser = get_parser()
     if 'interact' in sys.argv:
         code.interact(local=locals())
     else:
@@ -0,0 +1,150 @@
+"""
+Typo-tolerant game title matching for the HLT Chatbot.
+Titles are indexed by their character trigrams; a query collects candidates that share the rarest trigrams with it
+and verifies them by how many edits it takes to turn the query into some part of the title.
+"""
+import sqlite3
+import threading
+from collections import Counter
+
+def _grams(text, n=3):
+    text = f" {text} "
+    return {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+
+def _pattern_masks(pattern):
+    masks = {}
+    for i, c in enumerate(pattern):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    return masks
+
+def substring_distance(pattern, text, masks=None):
+    """
+    Smallest number of edits turning pattern into a substring of text, e.g. 1 for "breth of" in "breath of the wild".
+    Uses Myers' bit-parallel algorithm, so it costs a handful of integer operations per character of text.
+    """
+    m = len(pattern)
+    if m == 0: return 0
+    if masks is None: masks = _pattern_masks(pattern)
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv = full, 0
+    score = best = m
+    for c in text:
+        eq = masks.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last: score += 1
+        elif mh & last: score -= 1
+        if score < best: best = score
+
+        # No carry into the lowest bit: the match may start anywhere in text
+        ph = (ph << 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+
+    return best
+
+class FuzzyTitleMatcher:
+    """
+    In-memory trigram index over game titles.
+    One matcher can be shared by the bots of several threads: refreshes are serialized, and searches only ever see
+    titles being appended or cleared.
+    """
+    def __init__(self, max_postings=20000, max_candidates=64):
+        """
+        Args:
+            max_postings: Maximum number of postings read per query, which bounds the lookup time
+            max_candidates: Number of candidates verified per query
+        """
+        self.max_postings = max_postings
+        self.max_candidates = max_candidates
+        self.keys = []
+        self.titles = [] # None for titles that have since been replaced
+        self.postings = {}
+        self.positions = {} # key -> position in titles
+        self.last_rowid = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, key, title):
+        """Adds (or replaces) the title of key; the title should already be normalized"""
+        old = self.positions.get(key)
+        if old is not None:
+            if self.titles[old] == title: return
+            self.titles[old] = None
+
+        position = len(self.titles)
+        self.keys.append(key)
+        self.titles.append(title)
+        self.positions[key] = position
+
+        for gram in _grams(title):
+            self.postings.setdefault(gram, []).append(position)
+
+    def remove(self, key):
+        """Removes the title of key, if there is one"""
+        position = self.positions.pop(key, None)
+        if position is not None:
+            self.titles[position] = None
+
+    def refresh(self, cur : sqlite3.Cursor):
+        """Indexes the ascii_names rows added since the last refresh and drops the ones that were deleted"""
+        with self._lock:
+            rows = cur.execute("SELECT rowid, game_id, value FROM ascii_names WHERE rowid > ? ORDER BY rowid;", (self.last_rowid,)).fetchall()
+            for rowid, game_id, value in rows:
+                self.add(game_id, value)
+                self.last_rowid = rowid
+
+            # Renames only replace a title, so fewer rows than keys means games were deleted
+            if cur.execute("SELECT COUNT(*) FROM ascii_names;").fetchone()[0] < len(self.positions):
+                present = {game_id for game_id, in cur.execute("SELECT game_id FROM ascii_names;")}
+                for key in [key for key in self.positions if key not in present]:
+                    self.remove(key)
+
+        return len(rows)
+
+    def search(self, query, k=5, min_score=0.75):
+        """
+        Finds the titles closest to query
+        Args:
+            query: Normalized (part of a) title
+            k: Maximum number of results
+            min_score: Minimum similarity, from 0 to 1, of the returned titles
+        Returns:
+            List of (score, key, title) tuples, best first
+        """
+        query = query.strip()
+        if not query: return []
+
+        grams = sorted((self.postings[gram] for gram in _grams(query) if gram in self.postings), key=len)
+        if not grams: return []
+
+        # Each edit changes at most 3 trigrams, so any title within max_dist edits shares at least one of the
+        # 3 * max_dist + 1 rarest trigrams of the query; only those are read, within the postings budget
+        max_dist = int(len(query) * (1 - min_score))
+        counts = Counter()
+        read = 0
+        for postings in grams[:3 * max_dist + 1]:
+            if read and read + len(postings) > self.max_postings: break
+            counts.update(postings)
+            read += len(postings)
+
+        masks = _pattern_masks(query)
+        results = []
+        for position, _ in counts.most_common(self.max_candidates):
+            title = self.titles[position]
+            if title is None: continue
+
+            score = 1 - substring_distance(query, title, masks) / len(query)
+            if score >= min_score:
+                results.append((score, self.keys[position], title))
+
+        # Among equally close titles, prefer the ones the query covers best
+        results.sort(key=lambda result: (-result[0], len(result[2])))
+        return results[:k]
@@ -0,0 +1,181 @@
+"""
+Asynchronous IGDB client for igdb_scrape.py
+Keeps one pooled keep-alive HTTP session and paces requests with a token bucket tuned to IGDB's published limits
+(4 requests per second, at most 8 open requests), retrying throttled and failed requests with exponential backoff.
+Authors: Usaid Malik and Anthony Maranto
+"""
+import asyncio
+import json
+import random
+import time
+
+import aiohttp  # pip install aiohttp
+
+from igdb_scrape import PAGE_SIZE, collect_franchises, failed_request, load_names, name_queries, offline_miss, plan_games, response_key, store_names, write_page
+
+API_URL = 'https://api.igdb.com/v4/'
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AsyncIGDBClient:
+    """Rate-limited IGDB API client; use as an async context manager"""
+    def __init__(self, client_id, access_token, base_url=API_URL, rate=4, max_in_flight=8, max_retries=6, cache=None, offline=False):
+        """
+        Args:
+            client_id: Twitch client id
+            access_token: OAuth token from get_oauth
+            base_url: API root, e.g. a local stand-in server for testing
+            rate: Requests per second
+            max_in_flight: Maximum number of concurrent open requests
+            max_retries: Number of retries for throttled or failed requests
+            cache: Optional PersistentCache of responses, shared with igdb_scrape.igdb_request
+            offline: Only answer from the cache
+        """
+        self.base_url = base_url
+        self.headers = {
+            'Client-ID': client_id,
+            'Authorization': f'Bearer {access_token}',
+        }
+        self.bucket = TokenBucket(rate)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.cache = cache
+        self.offline = offline
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def request(self, endpoint, request):
+        """
+        Performs REST IGDB API call
+        Args:
+            endpoint: API endpoint to sent POST request to
+            request: APIpocalypse-formatted request for data
+        Returns:
+            JSON of data requested from IGDB
+        """
+        if self.cache is not None:
+            result = self.cache.get(response_key(endpoint, request))
+            if result is not None:
+                return result
+            if self.offline:
+                return offline_miss(endpoint)
+
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with self.in_flight:
+                try:
+                    async with self.session.post(self.base_url + endpoint, data=request) as response:
+                        if response.status != 429 and response.status < 500:
+                            response.raise_for_status()
+                            result = json.loads(await response.text())
+                            if self.cache is not None and isinstance(result, list):
+                                self.cache.put(response_key(endpoint, request), result)
+                            return result
+                        error = f'HTTP {response.status}'
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+
+            if attempt == self.max_retries: break
+            # Exponential backoff with jitter
+            delay = min(0.25 * 2 ** attempt, 16) * (0.5 + random.random())
+            print(f'{error} for {endpoint}, retrying in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+        raise IOError(f'IGDB request to {endpoint} failed after {self.max_retries + 1} attempts: {error}')
+
+async def resolve_names_async(client, connection, table, ids):
+    """Async version of igdb_scrape.resolve_names"""
+    names = load_names(connection, table, ids)
+    results = await asyncio.gather(*(client.request(table, query) for query in name_queries(set(ids) - set(names))))
+    names.update(store_names(connection, table, [result for batch in results if 'message' not in batch for result in batch]))
+    return failed_request(results) or names
+
+async def scrape_async(client, franchises, connection):
+    """
+    Async version of igdb_scrape.scrape: requests the new games of a page of franchises concurrently
+    Args:
+        client: AsyncIGDBClient
+        franchises: IGDB franchises results
+        connection: SQLite3 DB connection, for the games and genres already known
+    Returns:
+        List of Franchises, map of slug to Game, and map of genre id to genre name, or the error result of a request
+        that failed (e.g. an offline cache miss)
+    """
+    known, queries = plan_games(connection, franchises)
+    game_results = await asyncio.gather(*(client.request('games', query) for query in queries))
+    failed = failed_request(game_results)
+    if failed is not None:
+        return failed
+    franchise_list, game_map, genre_set = collect_franchises(franchises, game_results, known)
+
+    genre_map = await resolve_names_async(client, connection, 'genres', genre_set)
+    if 'message' in genre_map:
+        return genre_map
+
+    return franchise_list, game_map, genre_map
+
+async def crawl_async(client_id, access_token, connection, offset, max_pages=None, base_url=API_URL, **kwargs):
+    """
+    Async version of igdb_scrape.crawl; every page is written as soon as it completes
+    Args:
+        client_id: Twitch client id
+        access_token: OAuth token from get_oauth
+        connection: SQLite3 DB connection
+        offset: Franchise offset to start from
+        max_pages: Maximum number of pages to scrape (None for no limit)
+        base_url: API root
+        kwargs: Passed on to AsyncIGDBClient
+    Returns:
+        The offset to resume from
+    """
+    pages = 0
+    async with AsyncIGDBClient(client_id, access_token, base_url, **kwargs) as client:
+        while max_pages is None or pages < max_pages:
+            franchises = await client.request('franchises', f'fields name, slug, games; limit {PAGE_SIZE}; offset {offset};')
+            if not franchises:
+                break
+            if 'message' in franchises:
+                print("Franchises request failed:", franchises['message'])
+                break
+            print("Received", len(franchises), "franchises at offset", offset)
+
+            page = await scrape_async(client, franchises, connection)
+            if isinstance(page, dict):
+                print("Request failed:", page['message'], "- page at offset", offset, "not written")
+                break
+            franchise_list, game_map, genre_map = page
+            if not write_page(connection, franchise_list, game_map, genre_map, offset + len(franchises)):
+                break
+
+            offset += len(franchises)
+            pages += 1
+            if len(franchises) < PAGE_SIZE:
+                break  # Last page
+
+    return offset
@@ -3,13 +3,17 @@ CS4395 Project #2 (assisting script)
 Gets video game information from IGDB API and compiles into SQLite3 database. 
 Authors: Usaid Malik and Anthony Maranto
 """
+import os
 import sqlite3
-from time import sleep
+from time import sleep, time
 import requests
 from igdb.wrapper import IGDBWrapper  # pip install igdb-api-v4
 import json
 from tqdm import tqdm  # pip install tqdm
 
+from cache import PersistentCache, make_key
+from title_index import ensure_ascii_names, store_ascii_names
+
 def get_oauth(client_id, client_secret):
     """
     Gets OAuth token from Twitch.
@@ -23,6 +27,35 @@ def get_oauth(client_id, client_secret):
     result = requests.post(url)
     return result.json()['access_token']
 
+# Optional on-disk cache of API responses, see enable_response_cache
+response_cache = None
+offline = False
+
+def enable_response_cache(cache_dir, ttl=7 * 24 * 3600, max_bytes=2**30, replay_only=False):
+    """
+    Caches IGDB responses on disk, so that runs can be repeated without spending rate limit budget
+    Args:
+        cache_dir: Directory of the cache file
+        ttl: Seconds after which cached responses are requested again
+        max_bytes: Maximum size of the compressed responses before the least recently used ones get evicted
+        replay_only: Offline mode: only answer from the cache, however old the responses are, and never hit the network
+    Returns:
+        The PersistentCache
+    """
+    global response_cache, offline
+    os.makedirs(cache_dir, exist_ok=True)
+    response_cache = PersistentCache(os.path.join(cache_dir, 'igdb_responses.sqlite'), max_bytes, ttl=None if replay_only else ttl)
+    offline = replay_only
+    return response_cache
+
+def response_key(endpoint, request):
+    """Cache key of an API request"""
+    return make_key('igdb', endpoint, request)
+
+def offline_miss(endpoint):
+    """Error result for requests that offline mode can't answer"""
+    return {'message': f'{endpoint} request not in the response cache (offline)'}
+
 def igdb_request(igdb_wrapper, endpoint, request):
     """
     Performs REST IGDB API call
@@ -33,10 +66,40 @@ def igdb_request(igdb_wrapper, endpoint, request):
     Returns:
         JSON of data requested from IGDB 
     """
+    if response_cache is not None:
+        result = response_cache.get(response_key(endpoint, request))
+        if result is not None:
+            return result
+        if offline:
+            return offline_miss(endpoint)
     url = IGDBWrapper._build_url(endpoint)
     params = igdb_wrapper._compose_request(request)
     byte_result = requests.post(url, **params).content
-    return json.loads(byte_result.decode('utf-8'))
+    result = json.loads(byte_result.decode('utf-8'))
+    # Successful responses are lists; errors (e.g. too many requests) are dicts
+    if response_cache is not None and isinstance(result, list):
+        response_cache.put(response_key(endpoint, request), result)
+    return result
+
+def igdb_request_retry(igdb_wrapper, endpoint, request):
+    """
+    Performs REST IGDB API call, sleeping and retrying while IGDB reports too many requests
+    Args:
+        igdb_wrapper: IGDBWrapper used to compose API requests
+        endpoint: API endpoint to sent POST request to
+        request: APIpocalypse-formatted request for data
+    Returns:
+        JSON of data requested from IGDB (a dict with a 'message' if we gave up)
+    """
+    result = igdb_request(igdb_wrapper, endpoint, request)
+    # Handle API rate limit
+    sleep_timer = 4
+    while 'message' in result and sleep_timer < 10 and not offline:
+        print('Too many requests, sleeping . . .')
+        sleep(sleep_timer)
+        sleep_timer += 1
+        result = igdb_request(igdb_wrapper, endpoint, request)
+    return result
 
 _db_errors = False
 def execute_db_query(connection, query, values=[]):
@@ -65,6 +128,7 @@ class Franchise:
         self.name = name
         self.slug = slug
         self.games = set()
+        self.game_ids = set()  # Slugs of all its games, including the ones already in the DB
     
     def __repr__(self) -> str:
         output_str = f'{self.name}\n'
@@ -74,10 +138,15 @@ class Franchise:
     def add_game(self, game):
         """Adds game to Franchise"""
         self.games.add(game)
+        self.game_ids.add(game.slug)
+
+    def add_game_id(self, slug):
+        """Adds a game already in the DB to Franchise"""
+        self.game_ids.add(slug)
 
 class Game:
     """Stores Game information"""
-    def __init__(self, name, rating, release_date, storyline, summary, themes, genres, checksum, slug):
+    def __init__(self, name, rating, release_date, storyline, summary, themes, genres, checksum, slug, igdb_id=None, updated_at=None):
         """
         Game constructor
         Args:
@@ -89,6 +158,9 @@ class Game:
             themes: Themes associated with game
             genres: Genres associated with game
             checksum: IGDB Checksum of game
+            slug: IGDB slug of game, used as its id in the DB
+            igdb_id: IGDB id of game
+            updated_at: Time IGDB last updated the game
         """
         self.name = name
         self.rating = rating
@@ -99,6 +171,8 @@ class Game:
         self.genres = set(genres)
         self.checksum = checksum
         self.slug = slug
+        self.igdb_id = igdb_id
+        self.updated_at = updated_at
 
     def __eq__(self, other):
         return self.checksum == other.checksum
@@ -106,94 +180,153 @@ class Game:
     def __hash__(self) -> int:
         return hash(self.checksum)
 
-if '__main__' == __name__:
-    from argparse import ArgumentParser
-    
-    ap = ArgumentParser(description="Downloads game information to the games.sqlite file for use with bot.py")
-    
-    ap.add_argument("client-id", help="Your Twitch client id for API authentication")
-    ap.add_argument("client-secret", help="Your Twitch client secrret for API authentication")
-    
-    args = ap.parse_args()
-    
-    # Twitch Client ID/Secret used for API authentication
-    client_id = args.client_id
-    client_secret = args.client_secret
-    
-    db_connection = None  # Stores connection to SQL DB
-    # Attempt to connect to SQL DB
-    try:
-        db_connection = sqlite3.connect('games.sqlite')
-    except sqlite3.Error as e:
-        print('Failed to connect to DB')
-    
-    # Get authentication token for IGDB API calls
-    access_token = get_oauth(client_id, client_secret)
-    wrapper = IGDBWrapper(client_id, access_token)
-    
-    OFFSET = 0
-    db_connection.execute("CREATE TABLE IF NOT EXISTS metadata_numbers ("
-                          "  key TEXT NOT NULL PRIMARY KEY,"
-                          "  value INTEGER"
-                          ")")
-    OFFSET = next(iter(db_connection.execute("SELECT value FROM metadata_numbers WHERE key = 'offset';")), (OFFSET,))[0]
-    
-    # Request 500 franchises from IGDB
-    franchises = igdb_request(wrapper, 'franchises', f'fields name, slug, games; limit 500; offset {OFFSET};')
-    print("Received", len(franchises), "franchises")
-    franchise_list = []  # Stores all received Franchises
+# Maximum number of results IGDB returns per query
+PAGE_SIZE = 500
+
+game_fields = 'fields id, name, total_rating, category, first_release_date, storyline, summary, themes, genres, slug, checksum, updated_at;'
+
+def format_ids(ids):
+    """Formats IGDB ids for an APIcalypse where clause"""
+    ids = [int(item) for item in ids]
+    return str(tuple(ids)).replace(" ", "") if len(ids) > 1 else str(ids[0])
+
+def make_game(game):
+    """Builds a Game from an IGDB games result, handling possibly-null API data"""
+    game_rating = game.get('total_rating', -1)
+    game_release_date = game.get('first_release_date', None)
+    game_story = game.get('storyline', '')
+    game_summary = game.get('summary', '')
+    game_themes = game.get('themes', [])
+    game_genres = game.get('genres', [])
+    return Game(game['name'], game_rating, game_release_date, game_story, game_summary, game_themes, game_genres, game['checksum'], game["slug"],
+                game.get('id'), game.get('updated_at'))
+
+def known_games(connection, ids):
+    """
+    Looks up which IGDB game ids are already in the DB
+    Args:
+        connection: SQLite3 DB connection
+        ids: IGDB game ids
+    Returns:
+        Map of IGDB id to slug of the known games
+    """
+    ids = sorted(ids)
+    known = {}
+    for i in range(0, len(ids), PAGE_SIZE):
+        chunk = ids[i:i + PAGE_SIZE]
+        known.update(connection.execute(f"SELECT igdb_id, id FROM games WHERE igdb_id IN ({','.join('?' * len(chunk))});", chunk))
+    return known
+
+def game_queries(ids):
+    """Batched queries for the main games among the given IGDB ids, one full page each"""
+    ids = sorted(ids)
+    return [game_fields + f' where id = {format_ids(ids[i:i + PAGE_SIZE])} & category = 0; limit {PAGE_SIZE};' for i in range(0, len(ids), PAGE_SIZE)]
+
+def plan_games(connection, franchises):
+    """
+    Collects the game ids of a page of franchises and splits off the ones already in the DB
+    Returns:
+        Map of IGDB id to slug of the known games, and the queries for the others
+    """
+    ids = {int(game) for franchise in franchises for game in franchise.get('games', [])}
+    known = known_games(connection, ids)
+    return known, game_queries(ids - set(known))
+
+def failed_request(results):
+    """The first error result (a dict with a 'message') among API results, or None if they all succeeded"""
+    return next((result for result in results if 'message' in result), None)
+
+def collect_franchises(franchises, game_results, known):
+    """
+    Builds Franchise and Game objects from IGDB results
+    Args:
+        franchises: IGDB franchises results
+        game_results: IGDB games results of the queries from plan_games, which all succeeded
+        known: Map of IGDB id to slug of the games already in the DB
+    Returns:
+        List of Franchises, map of slug to Game of the new games, and set of their genres
+    """
     genre_set = set()  # Stores all seen genres
     game_map = {}
-    query_string = 'fields name, total_rating, category, first_release_date, storyline, summary, themes, genres, slug, checksum; where id = {};'
-    # Loop through all Franchises
-    iterable = tqdm(franchises)
-    for franchise in iterable:
-        franchise_games = franchise.get('games', [])
-        # Only interested in franchises with 3+ related games
-        if len(franchise_games) < 1:
+    by_id = {}
+    for game_result in game_results:
+        for game in game_result:
+            game_obj = make_game(game)
+            genre_set.update(game_obj.genres)
+            game_map[game_obj.slug] = game_obj
+            by_id[game['id']] = game_obj
+
+    franchise_list = []  # Stores all received Franchises
+    for franchise in franchises:
+        if not franchise.get('games'):
             continue
         franchise_obj = Franchise(franchise['name'], franchise["slug"])
-        iterable.set_postfix({"franchise": franchise_obj.name}, False)
-        # Get information for every Game related to the Franchise
-        game_ids = str(tuple(int(game_id) for game_id in franchise_games)).replace(" ", "") if len(franchise_games) > 1 else str(franchise_games[0])
-        this_query = query_string.format(game_ids)
-        game_result = igdb_request(wrapper, 'games', this_query)
-        # Handle API rate limit
-        sleep_timer = 4
-        while 'message' in game_result and sleep_timer < 10:
-            print('Too many requests, sleeping . . .')
-            sleep(sleep_timer)
-            sleep_timer += 1
-            game_result = igdb_request(wrapper, 'games', query_string.format(this_query))
-        if len(game_result) == 0:
-            continue
-        for game in game_result:
-            if game['category'] != 0:  # Not a main game, ignore
-                continue
-            # Handle possibly-null API data
-            if game_map.get(game["slug"]):
-                game_obj = game_map[game["slug"]]
-            else:
-                game_rating = game.get('total_rating', -1)
-                game_release_date = game.get('first_release_date', None)
-                game_story = game.get('storyline', '')
-                game_summary = game.get('summary', '')
-                game_themes = game.get('themes', [])
-                game_genres = game.get('genres', [])
-                game_obj = Game(game['name'], game_rating, game_release_date, game_story, game_summary, game_themes, game_genres, game['checksum'], game["slug"])
-                genre_set.update(game_obj.genres)
-                game_map[game_obj.slug] = game_obj
-            franchise_obj.add_game(game_obj)
+        for game in franchise['games']:
+            if game in by_id:
+                franchise_obj.add_game(by_id[game])
+            elif game in known:
+                franchise_obj.add_game_id(known[game])
+            # Otherwise not a main game
         franchise_list.append(franchise_obj)
-    
-    # Get names of genres using Genre IDs received with Game information
-    genre_map = {}
-    for genre in genre_set:
-        # Do a request to get genre name
-        genre_result = igdb_request(wrapper, 'genres', f'fields name, id; where id = {genre};')
-        for result in genre_result:
-            genre_map[result['id']] = result['name']
-    
+    return franchise_list, game_map, genre_set
+
+def name_queries(ids):
+    """Batched APIcalypse queries resolving the names of the given ids of a lookup endpoint (genres, themes...)"""
+    ids = sorted(ids)
+    return [f'fields name, id; where id = {format_ids(ids[i:i + PAGE_SIZE])}; limit {PAGE_SIZE};' for i in range(0, len(ids), PAGE_SIZE)]
+
+def load_names(connection, table, ids):
+    """
+    Looks up names already stored in a local lookup table
+    Args:
+        connection: SQLite3 DB connection
+        table: Lookup table, named after its IGDB endpoint (e.g. genres)
+        ids: IGDB ids to look up
+    Returns:
+        Map of id to name for the ids that are known locally
+    """
+    names = {}
+    ids = list(ids)
+    for i in range(0, len(ids), PAGE_SIZE):
+        chunk = ids[i:i + PAGE_SIZE]
+        names.update(connection.execute(f"SELECT id, name FROM {table} WHERE id IN ({','.join('?' * len(chunk))});", chunk))
+    return names
+
+def store_names(connection, table, results):
+    """Stores IGDB lookup results (dicts with id and name) in a local lookup table and returns them as a map"""
+    names = {result['id']: result['name'] for result in results}
+    if names:
+        execute_db_query(connection, f"INSERT OR REPLACE INTO {table} (id, name) VALUES (?, ?)", list(names.items()))
+    return names
+
+def resolve_names(connection, wrapper, table, ids):
+    """
+    Resolves the names of lookup ids (e.g. genres), requesting only the ones not stored locally yet, in batches
+    Args:
+        connection: SQLite3 DB connection
+        wrapper: IGDBWrapper used to compose API requests
+        table: Lookup table, named after its IGDB endpoint
+        ids: IGDB ids to resolve
+    Returns:
+        Map of id to name, or the error result of a request that failed (the names that were resolved are still stored)
+    """
+    names = load_names(connection, table, ids)
+    results = []
+    for query in name_queries(set(ids) - set(names)):
+        result = igdb_request_retry(wrapper, table, query)
+        if 'message' in result:
+            store_names(connection, table, results)
+            return result
+        results.extend(result)
+    names.update(store_names(connection, table, results))
+    return names
+
+def create_tables(connection):
+    """Creates the games database tables if they don't exist"""
+    connection.execute("CREATE TABLE IF NOT EXISTS metadata_numbers ("
+                       "  key TEXT NOT NULL PRIMARY KEY,"
+                       "  value INTEGER"
+                       ")")
     # SQL queries to create DB tables
     create_franchise = '''
     CREATE TABLE IF NOT EXISTS franchises (
@@ -229,62 +362,306 @@ if '__main__' == __name__:
     );
     '''
     # Create DB tables
-    #execute_db_query(db_connection, 'DROP TABLE IF EXISTS franchises;')
-    #execute_db_query(db_connection, 'DROP TABLE IF EXISTS games;')
-    #execute_db_query(db_connection, 'DROP TABLE IF EXISTS in_franchise;')
-    #execute_db_query(db_connection, 'DROP TABLE IF EXISTS in_genre;')
-    execute_db_query(db_connection, create_franchise)
-    execute_db_query(db_connection, create_game)
-    execute_db_query(db_connection, create_in_franchise)
-    execute_db_query(db_connection, create_in_genre)
+    #execute_db_query(connection, 'DROP TABLE IF EXISTS franchises;')
+    #execute_db_query(connection, 'DROP TABLE IF EXISTS games;')
+    #execute_db_query(connection, 'DROP TABLE IF EXISTS in_franchise;')
+    #execute_db_query(connection, 'DROP TABLE IF EXISTS in_genre;')
+    execute_db_query(connection, create_franchise)
+    execute_db_query(connection, create_game)
+    execute_db_query(connection, create_in_franchise)
+    execute_db_query(connection, create_in_genre)
+    # Columns added for delta syncs
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(games);")}
+    for column, kind in (('igdb_id', 'INTEGER'), ('checksum', 'TEXT'), ('updated_at', 'INTEGER')):
+        if column not in columns:
+            execute_db_query(connection, f"ALTER TABLE games ADD COLUMN {column} {kind};")
+    execute_db_query(connection, "CREATE INDEX IF NOT EXISTS games_igdb_id ON games(igdb_id);")
+    # Games whose relations need to be extracted again by bot.py's preprocessing
+    execute_db_query(connection, "CREATE TABLE IF NOT EXISTS changed_games (game_id TEXT PRIMARY KEY, changed_at INTEGER);")
+    # Normalized titles for bot.py, written along with the games by upsert_games
+    ensure_ascii_names(connection)
+    # Lookup tables, named after their IGDB endpoints
+    for table in ('genres',):
+        execute_db_query(connection, f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, name TEXT NOT NULL);")
+
+def upsert_games(connection, games, genre_map):
+    """
+    Inserts or updates the given games, skipping the ones whose checksum hasn't changed, and records the changed ones
+    in changed_games. Doesn't commit, so it can be part of a larger transaction.
+    Args:
+        connection: SQLite3 DB connection
+        games: Iterable of Games
+        genre_map: Map of genre id to genre name
+    Returns:
+        List of the ids (slugs) of the games that were new or changed
+    """
+    games = {game.slug: game for game in games}
+    known = {}
+    slugs = list(games)
+    for i in range(0, len(slugs), PAGE_SIZE):
+        chunk = slugs[i:i + PAGE_SIZE]
+        known.update(connection.execute(f"SELECT id, checksum FROM games WHERE id IN ({','.join('?' * len(chunk))});", chunk))
+    changed = [game for slug, game in games.items() if slug not in known or known[slug] != game.checksum]
+    
+    # Unlike INSERT OR REPLACE, the upsert keeps the rowid, so nothing downstream sees a delete
+    connection.executemany('''
+    INSERT INTO games (id, name, release_date, summary, story, rating, igdb_id, checksum, updated_at)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+      name = excluded.name, release_date = excluded.release_date, summary = excluded.summary, story = excluded.story,
+      rating = excluded.rating, igdb_id = excluded.igdb_id, checksum = excluded.checksum, updated_at = excluded.updated_at
+    ''', [(game.slug, game.name, game.release_date, game.summary, game.story, game.rating, game.igdb_id, game.checksum, game.updated_at)
+          for game in changed])
+    store_ascii_names(connection, [(game.slug, game.name) for game in changed])
     
+    in_genre = set()  # Data to insert into in_genre table
+    for game in changed:
+        for genre in game.genres:
+            if genre in genre_map:  # IGDB may no longer know it
+                in_genre.add((game.slug, genre_map[genre]))
+    connection.executemany("DELETE FROM in_genre WHERE game_id = ?", [(game.slug,) for game in changed if game.slug in known])
+    connection.executemany("INSERT OR REPLACE INTO in_genre VALUES (?, ?)", list(in_genre))
+    
+    # New games are queued too, since streaming preprocessing pages on id and misses the ones sorting behind its cursor;
+    # rows written before checksums were stored only get them backfilled
+    changed_ids = [(game.slug,) for game in changed if game.slug not in known or known[game.slug] is not None]
+    connection.executemany("INSERT OR REPLACE INTO changed_games (game_id, changed_at) VALUES (?, strftime('%s', 'now'))", changed_ids)
+    
+    return [game.slug for game in changed]
+
+def write_page(connection, franchise_list, game_map, genre_map, next_offset):
+    """
+    Inserts a page of scraped franchises, games and their mappings into the DB and advances the offset, all in one
+    transaction, so a crash either keeps the whole page or none of it
+    Args:
+        connection: SQLite3 DB connection
+        franchise_list: List of Franchises
+        game_map: Map of slug to Game
+        genre_map: Map of genre id to genre name
+        next_offset: Franchise offset to resume from once this page is written
+    Returns:
+        True if the page was written
+    """
+    global _db_errors
     # SQL queries to insert data into DB tables
     franchise_insert = '''
     INSERT OR REPLACE INTO
       franchises VALUES (?, ?)
     '''
-    game_insert = '''
-    INSERT OR REPLACE INTO
-      games VALUES (?, ?, ?, ?, ?, ?)
-    '''
     in_franchise_insert = '''
     INSERT OR REPLACE INTO
       in_franchise VALUES (?, ?)
     '''
-    in_genre_insert = '''
-    INSERT OR REPLACE INTO
-      in_genre VALUES (?, ?)
-    '''
 
     # Format data into SQLite3-compatible form
     franchise_values = []
     in_franchise = []  # Data to insert into in_franchise table
-    in_genre = set()  # Data to insert into in_genre table
-    game_values = set()  # Data to insert into games table
-    for game in game_map.values():
-        summary = game.summary #.replace('\'', '\'\'')
-        story = game.story #.replace('\'', '\'\'')
-        # Add game, franchise, genres, and game-franchise/game-genre mappings
-        game_values.add((game.slug, game.name, game.release_date, summary, story, game.rating))
-        
-        for genre in game.genres:
-            in_genre.add((game.slug, genre_map[genre]))
-    
     # Loop through each franchise and add data to corresponding tables
     for franchise in franchise_list:
         franchise_values.append((franchise.slug, franchise.name))
-        for game in franchise.games:
-            # Escape ' to avoid SQL errors
-            in_franchise.append((game.slug, franchise.slug))
+        for slug in franchise.game_ids:
+            in_franchise.append((slug, franchise.slug))
 
     # Insert data into corresponding DB tables
-    execute_db_query(db_connection, franchise_insert, franchise_values)
-    execute_db_query(db_connection, game_insert, list(game_values))
-    execute_db_query(db_connection, in_franchise_insert, in_franchise)
-    execute_db_query(db_connection, in_genre_insert, list(in_genre))
+    try:
+        with connection:
+            connection.executemany(franchise_insert, franchise_values)
+            upsert_games(connection, game_map.values(), genre_map)
+            connection.executemany(in_franchise_insert, in_franchise)
+            connection.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES('offset', ?);", (next_offset,))
+    except sqlite3.Error as e:
+        print(f'SQL Error {e} occurred while writing the page; offset left at its previous value')
+        _db_errors = True
+        return False
+    return True
+
+def request_franchises(wrapper, offset):
+    """Requests a page of franchises from IGDB"""
+    # Request 500 franchises from IGDB
+    return igdb_request_retry(wrapper, 'franchises', f'fields name, slug, games; limit {PAGE_SIZE}; offset {offset};')
+
+def scrape(wrapper, franchises, connection):
+    """
+    Requests the games of a page of franchises that aren't in the DB yet from IGDB, one request at a time
+    Args:
+        wrapper: IGDBWrapper used to compose API requests
+        franchises: IGDB franchises results
+        connection: SQLite3 DB connection, for the games and genres already known
+    Returns:
+        List of Franchises, map of slug to Game, and map of genre id to genre name, or the error result of the first
+        request that failed, in which case the page must not be written
+    """
+    known, queries = plan_games(connection, franchises)
+    # Get information for every new Game of the Franchises, a full page at a time
+    game_results = []
+    for query in tqdm(queries):
+        result = igdb_request_retry(wrapper, 'games', query)
+        if 'message' in result:
+            return result
+        game_results.append(result)
+    franchise_list, game_map, genre_set = collect_franchises(franchises, game_results, known)
+    
+    # Get names of genres using Genre IDs received with Game information
+    genre_map = resolve_names(connection, wrapper, 'genres', genre_set)
+    if 'message' in genre_map:
+        return genre_map
+    
+    return franchise_list, game_map, genre_map
+
+def crawl(wrapper, connection, offset, max_pages=None):
+    """
+    Scrapes page after page of franchises until IGDB runs out of them, writing each page as soon as it completes
+    Args:
+        wrapper: IGDBWrapper used to compose API requests
+        connection: SQLite3 DB connection
+        offset: Franchise offset to start from
+        max_pages: Maximum number of pages to scrape (None for no limit)
+    Returns:
+        The offset to resume from
+    """
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        franchises = request_franchises(wrapper, offset)
+        if not franchises:
+            break
+        if 'message' in franchises:
+            print("Franchises request failed:", franchises['message'])
+            break
+        print("Received", len(franchises), "franchises at offset", offset)
+        
+        page = scrape(wrapper, franchises, connection)
+        if isinstance(page, dict):
+            print("Request failed:", page['message'], "- page at offset", offset, "not written")
+            break
+        franchise_list, game_map, genre_map = page
+        if not write_page(connection, franchise_list, game_map, genre_map, offset + len(franchises)):
+            break
+        
+        offset += len(franchises)
+        pages += 1
+        if len(franchises) < PAGE_SIZE:
+            break  # Last page
+    return offset
+
+def sync_queries(since, until, offset):
+    """Query for a page of main games IGDB updated in the (since, until] window"""
+    return game_fields + f' where updated_at > {since} & updated_at <= {until} & category = 0; sort updated_at asc; limit {PAGE_SIZE}; offset {offset};'
+
+def sync_page(connection, games, genre_map):
+    """
+    Writes a page of updated games from a delta sync in one transaction
+    Only games already in the DB are considered; new games come in through crawls with their franchises.
+    Returns:
+        List of the ids of the games that actually changed
+    """
+    games = [make_game(game) for game in games]
+    slugs = [game.slug for game in games]
+    known = set()
+    for i in range(0, len(slugs), PAGE_SIZE):
+        chunk = slugs[i:i + PAGE_SIZE]
+        known.update(row[0] for row in connection.execute(f"SELECT id FROM games WHERE id IN ({','.join('?' * len(chunk))});", chunk))
+    with connection:
+        return upsert_games(connection, [game for game in games if game.slug in known], genre_map)
+
+def sync(wrapper, connection):
+    """
+    Delta sync: requests only the games IGDB updated since the last sync and upserts the ones whose checksum changed
+    Args:
+        wrapper: IGDBWrapper used to compose API requests
+        connection: SQLite3 DB connection
+    Returns:
+        List of the ids of the games that changed
+    """
+    since = next(iter(connection.execute("SELECT value FROM metadata_numbers WHERE key = 'sync_updated_at';")), (None,))[0]
+    if since is None:
+        since = connection.execute("SELECT COALESCE(MAX(updated_at), 0) FROM games;").fetchone()[0]
+    until = int(time())  # Fixed upper bound, so that the pages don't shift while we go through them
+    
+    changed = []
+    offset = 0
+    while True:
+        games = igdb_request_retry(wrapper, 'games', sync_queries(since, until, offset))
+        if games is None or 'message' in games:
+            print("Sync stopped early; the next one starts from the same point")
+            return changed
+        if not games:
+            break
+        genre_map = resolve_names(connection, wrapper, 'genres', {genre for game in games for genre in game.get('genres', [])})
+        if 'message' in genre_map:
+            print("Sync stopped early; the next one starts from the same point")
+            return changed
+        changed.extend(sync_page(connection, games, genre_map))
+        print(f"Checked {offset + len(games)} updated games, {len(changed)} changed")
+        
+        offset += len(games)
+        if len(games) < PAGE_SIZE:
+            break
+    
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES('sync_updated_at', ?);", (until,))
+    return changed
+
+if '__main__' == __name__:
+    from argparse import ArgumentParser
+    
+    ap = ArgumentParser(description="Downloads game information to the games.sqlite file for use with bot.py")
+    
+    ap.add_argument("client_id", metavar="client-id", help="Your Twitch client id for API authentication")
+    ap.add_argument("client_secret", metavar="client-secret", help="Your Twitch client secrret for API authentication")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="Issue requests concurrently, as fast as IGDB's rate limits allow (requires aiohttp)")
+    ap.add_argument("--crawl", action="store_true",
+                    help="Keep scraping pages of franchises until IGDB runs out of them, writing each page as it completes")
+    ap.add_argument("--max-pages", type=int, default=None, help="Maximum number of pages to scrape with --crawl")
+    ap.add_argument("--sync", action="store_true",
+                    help="Delta sync: only update the games IGDB changed since the last sync, instead of scraping franchises")
+    ap.add_argument("--cache-dir", default=None, help="Cache IGDB responses in this directory")
+    ap.add_argument("--cache-ttl", type=float, default=7 * 24 * 3600, help="Seconds after which cached responses expire")
+    ap.add_argument("--cache-size", type=int, default=1024, help="Maximum size of the response cache in MiB")
+    ap.add_argument("--offline", action="store_true",
+                    help="Replay responses from --cache-dir only, without authenticating or requesting anything from IGDB")
+    
+    args = ap.parse_args()
+    if args.offline and args.cache_dir is None:
+        ap.error("--offline needs a --cache-dir to replay")
+    if args.cache_dir is not None:
+        enable_response_cache(args.cache_dir, args.cache_ttl, args.cache_size * 2**20, replay_only=args.offline)
+    
+    # Twitch Client ID/Secret used for API authentication
+    client_id = args.client_id
+    client_secret = args.client_secret
+    
+    db_connection = None  # Stores connection to SQL DB
+    # Attempt to connect to SQL DB
+    try:
+        db_connection = sqlite3.connect('games.sqlite')
+    except sqlite3.Error as e:
+        print('Failed to connect to DB')
+    
+    # Get authentication token for IGDB API calls
+    access_token = 'offline' if offline else get_oauth(client_id, client_secret)
+    wrapper = IGDBWrapper(client_id, access_token)
+    
+    create_tables(db_connection)
+    OFFSET = next(iter(db_connection.execute("SELECT value FROM metadata_numbers WHERE key = 'offset';")), (0,))[0]
+    max_pages = args.max_pages if args.crawl else 1
+    
+    if args.sync:
+        changed = sync(wrapper, db_connection)
+        print(len(changed), "games changed; run `python bot.py preprocess` to extract their relations again")
+        raise SystemExit
+    
+    if args.use_async:
+        import asyncio
+        from igdb_async import crawl_async
+        offset = asyncio.run(crawl_async(client_id, access_token, db_connection, OFFSET, max_pages=max_pages,
+                                         cache=response_cache, offline=offline))
+    else:
+        offset = crawl(wrapper, db_connection, OFFSET, max_pages=max_pages)
 
+    if response_cache is not None:
+        print("Response cache:", response_cache.stats())
     if _db_errors:
-        print("Database errors detected; not updating offset metadata")
+        print("Database errors detected; offset left at", offset)
     else:
-        db_connection.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES('offset', ?);", (OFFSET + 500,))
-        db_connection.commit()
\ No newline at end of file
+        print("Done; next run resumes at offset", offset)
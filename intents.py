@@ -0,0 +1,51 @@
+"""
+Fast path for the HLT Chatbot.
+Recognizes the templated questions GameBot supports with regular expressions, so that they can be answered without a
+CoreNLP parse. Anything that doesn't match one of the templates exactly goes through the full parse.
+"""
+import re
+
+_TITLE = r"(?P<title>[^?]+?)" # A question mark ends the question, so a title can't span two of them
+_BE = r"(?:'s|\s+is|\s+was)"
+_POSSESSIVE = r"(?:'s|')"
+
+# (intent, pattern) pairs; questions have to end with a question mark, like in GameBot.process
+_TEMPLATES = [
+    ("release", rf"when\s+(?:was|were)\s+{_TITLE}\s+(?:first\s+|originally\s+)?released\s*\?"),
+    ("rating", rf"what{_BE}\s+the\s+rating\s+of\s+{_TITLE}\s*\?"),
+    ("rating", rf"what{_BE}\s+{_TITLE}{_POSSESSIVE}\s+rating\s*\?"),
+    ("rating", rf"how\s+(?:is|was)\s+{_TITLE}\s+rated\s*\?"),
+    ("story", rf"what{_BE}\s+the\s+story\s+of\s+{_TITLE}\s*\?"),
+    ("story", rf"what{_BE}\s+{_TITLE}{_POSSESSIVE}\s+story\s*\?"),
+    ("description", rf"what{_BE}\s+the\s+description\s+of\s+{_TITLE}\s*\?"),
+    ("description", rf"what{_BE}\s+{_TITLE}{_POSSESSIVE}\s+description\s*\?"),
+    ("franchise", rf"what\s+franchises?\s+(?:is|was)\s+{_TITLE}\s+(?:a\s+)?(?:part\s+of|in)\s*\?"),
+    ("franchise", rf"what(?:'s|\s+is|\s+are)\s+the\s+franchises?\s+of\s+{_TITLE}\s*\?"),
+    ("franchise", rf"what(?:'s|\s+is|\s+are)\s+{_TITLE}{_POSSESSIVE}\s+franchises?\s*\?"),
+    ("fact", r"(?:tell|give)\s+me\s+something(?:\s+about\s+(?:the\s+)?(?P<title>[^?]+?))?\s*[.!]?"),
+]
+
+INTENTS = [(intent, re.compile(pattern, re.IGNORECASE)) for intent, pattern in _TEMPLATES]
+
+def match_intent(line : str):
+    """
+    Matches a line of user input against the templates
+    Returns:
+        (intent, title) tuple, where title is None for "tell me something" without a franchise, or None if no template
+        matches the whole line
+    """
+    line = line.strip()
+    for intent, pattern in INTENTS:
+        match = pattern.fullmatch(line)
+        if match is not None:
+            title = match.group("title")
+            return intent, title.strip(" \"'") if title else None
+
+    return None
+
+def title_options(title : str):
+    """Descriptors to look the title up by, e.g. with and without a leading article"""
+    options = [title]
+    stripped = re.sub(r"^(?:the|a|an)\s+", "", title, flags=re.IGNORECASE)
+    if stripped and stripped != title: options.append(stripped)
+    return options
@@ -0,0 +1,273 @@
+"""
+Latency instrumentation of the HLT Chatbot.
+Code marks its stages with `with metrics.span("name"):` (or the @metrics.timed("name") decorator), counts events with
+metrics.count("name") and wraps each line of user input in `with metrics.turn():`. Every span feeds a rolling histogram
+of its latest durations (p50/p95/p99), and each turn also records how many SQL statements and CoreNLP calls it made.
+Metrics are exported as JSON lines (one record per turn) or as Prometheus text over HTTP.
+Everything is off until enable() is called; while off, span() returns a shared no-op context manager and count()
+returns right away, so the instrumentation can stay in the hot paths.
+"""
+import contextlib
+import functools
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+enabled = False
+
+_NULL_SPAN = contextlib.nullcontext()
+_lock = threading.Lock()
+_local = threading.local() # The turn running on each thread, and the timed functions it's inside of
+
+spans = {} # Span name -> RollingHistogram of seconds
+per_turn = {} # Counter name -> RollingHistogram of counts per turn
+counters = {} # Counter name -> total count
+window = 2048
+log_file = None
+
+class RollingHistogram:
+    """The latest `window` observations, plus the count and sum of all of them; safe to share between threads"""
+    def __init__(self, window=2048):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self.values.append(value)
+            self.count += 1
+            self.total += value
+
+    def percentiles(self, fractions=(0.5, 0.95, 0.99)):
+        return self.summary(fractions)[2]
+
+    def summary(self, fractions=(0.5, 0.95, 0.99)):
+        """Consistent count, sum and percentiles"""
+        with self._lock:
+            count, total, values = self.count, self.total, list(self.values)
+        values.sort()
+        if not values: return count, total, {fraction: None for fraction in fractions}
+        return count, total, {fraction: values[min(len(values) - 1, int(len(values) * fraction))] for fraction in fractions}
+
+class _Turn:
+    def __init__(self):
+        self.spans = {} # name -> [seconds, calls]
+        self.counts = {}
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+def enable(log_path=None, history=2048):
+    """
+    Turns the instrumentation on
+    Args:
+        log_path: Optional file to append one JSON line per turn to
+        history: Number of observations each rolling histogram keeps
+    """
+    global enabled, log_file, window
+    window = history
+    if log_path is not None:
+        log_file = open(log_path, "a", encoding="utf-8")
+    enabled = True
+
+def disable():
+    global enabled, log_file
+    enabled = False
+    if log_file is not None:
+        log_file.close()
+        log_file = None
+
+def reset():
+    with _lock:
+        spans.clear()
+        per_turn.clear()
+        counters.clear()
+
+def _histogram(table, name):
+    histogram = table.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = table.setdefault(name, RollingHistogram(window))
+    return histogram
+
+def observe(name, seconds):
+    """Records a duration for the span `name`"""
+    _histogram(spans, name).add(seconds)
+    turn = getattr(_local, "turn", None)
+    if turn is not None:
+        entry = turn.spans.get(name)
+        if entry is None:
+            turn.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+def span(name):
+    """Context manager timing the stage `name`"""
+    if not enabled: return _NULL_SPAN
+    return _Span(name)
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the span `name`
+    Only the outermost call of a recursive function is timed, since it already includes the time of the inner ones.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled: return fn(*args, **kwargs)
+            active = getattr(_local, "timed", None)
+            if active is None:
+                active = _local.timed = set()
+            if name in active: return fn(*args, **kwargs)
+
+            active.add(name)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                active.discard(name)
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """Counts n events called `name`, in total and for the current turn"""
+    if not enabled: return
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+    turn = getattr(_local, "turn", None)
+    if turn is not None:
+        turn.counts[name] = turn.counts.get(name, 0) + n
+
+def _trace(statement):
+    if not statement.startswith("--"): # Statements run by triggers are reported as comments
+        count("sql_queries")
+
+def watch(con):
+    """Counts the SQL statements run on a connection as sql_queries (only if enabled before the call)"""
+    if enabled:
+        con.set_trace_callback(_trace)
+
+@contextlib.contextmanager
+def turn(**fields):
+    """
+    Groups the spans and counts of one line of user input
+    Args:
+        fields: Extra values for the turn's JSON line (e.g. the user)
+    """
+    if not enabled or getattr(_local, "turn", None) is not None:
+        yield None
+        return
+
+    current = _local.turn = _Turn()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        _local.turn = None
+        elapsed = time.perf_counter() - start
+        _histogram(spans, "turn").add(elapsed)
+        for name in ("sql_queries", "corenlp_calls"):
+            current.counts.setdefault(name, 0)
+        for name, value in current.counts.items():
+            _histogram(per_turn, name).add(value)
+
+        if log_file is not None:
+            record = {
+                "time": time.time(),
+                **fields,
+                "seconds": elapsed,
+                "spans": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in current.spans.items()},
+                "counts": current.counts
+            }
+            line = json.dumps(record) + "\n"
+            with _lock:
+                log_file.write(line)
+                log_file.flush()
+
+def snapshot():
+    """All metrics as a JSON-compatible dictionary"""
+    def summarize(histogram):
+        count, total, percentiles = histogram.summary()
+        p50, p95, p99 = percentiles.values()
+        return {"count": count, "sum": total, "p50": p50, "p95": p95, "p99": p99}
+
+    with _lock:
+        return {
+            "spans": {name: summarize(histogram) for name, histogram in spans.items()},
+            "per_turn": {name: summarize(histogram) for name, histogram in per_turn.items()},
+            "counters": dict(counters)
+        }
+
+def dump():
+    """Appends the current snapshot to the JSON-lines log (e.g. at the end of a preprocessing run)"""
+    if log_file is None: return
+    line = json.dumps({"time": time.time(), "snapshot": snapshot()}) + "\n"
+    with _lock:
+        log_file.write(line)
+        log_file.flush()
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"")
+
+def prometheus_text(prefix="gamebot"):
+    """All metrics in the Prometheus text exposition format"""
+    data = snapshot()
+    lines = []
+
+    for metric, table, label in ((f"{prefix}_span_seconds", data["spans"], "span"),
+                                 (f"{prefix}_turn_events", data["per_turn"], "event")):
+        lines.append(f"# TYPE {metric} summary")
+        for name, summary in sorted(table.items()):
+            labels = f"{label}=\"{_label(name)}\""
+            for quantile in ("p50", "p95", "p99"):
+                if summary[quantile] is not None:
+                    lines.append(f"{metric}{{{labels},quantile=\"0.{quantile[1:]}\"}} {summary[quantile]}")
+            lines.append(f"{metric}_sum{{{labels}}} {summary['sum']}")
+            lines.append(f"{metric}_count{{{labels}}} {summary['count']}")
+
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"{prefix}_events_total{{event=\"{_label(name)}\"}} {value}")
+
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=9464, host="127.0.0.1"):
+    """Serves /metrics (Prometheus text) and /metrics.json from a background thread; returns the HTTP server"""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
@@ -0,0 +1,185 @@
+"""
+Storage and lookups for the relations table of the HLT Chatbot.
+Besides the raw subject/relation/object columns, the table has lowercased *_key columns (virtual generated columns,
+so they never need to be written or backfilled) with secondary indexes on subject_key, (relation_key, subject_key)
+and (game_id, subject_key). find_relations turns case-insensitive lookups into index seeks on them whenever the
+value has no LIKE wildcard, and check_query_plans makes sure the hot lookups keep doing so.
+"""
+import random
+import re
+import sqlite3
+import sys
+
+# Explicit column list: SELECT * would also return the generated *_key columns
+RELATION_COLUMNS = "subject, relation, object, original_phrase, extra, game_id, franchise_id"
+
+KEY_COLUMNS = ("subject", "relation", "object")
+
+INDEXES = {
+    "relations_subject": "subject_key",
+    "relations_relation_subject": "relation_key, subject_key",
+    "relations_game_subject": "game_id, subject_key"
+}
+
+def create_relations_table(cur : sqlite3.Cursor):
+    # TODO: Mark "there be" as existential
+    # cur.execute("DROP TABLE IF EXISTS relations;")
+    cur.execute("CREATE TABLE IF NOT EXISTS relations ("
+                "  subject TEXT NOT NULL,"
+                "  relation TEXT NOT NULL,"
+                "  object TEXT NOT NULL,"
+                "  original_phrase TEXT NOT NULL," # Original phrase
+                "  extra TEXT," # Optional extra text
+                "  game_id TEXT NOT NULL," # Optional game_id
+                "  franchise_id TEXT," # Optional franchise id
+                "  PRIMARY KEY(subject, relation, object, game_id)"
+                ");")
+    ensure_relation_indexes(cur)
+
+def ensure_relation_indexes(cur : sqlite3.Cursor):
+    """Adds the normalized key columns and the secondary indexes to an existing relations table"""
+    columns = {row[1] for row in cur.execute("PRAGMA table_xinfo(relations);")}
+    for column in KEY_COLUMNS:
+        if column + "_key" not in columns:
+            cur.execute(f"ALTER TABLE relations ADD COLUMN {column}_key TEXT GENERATED ALWAYS AS (lower(trim({column}))) VIRTUAL;")
+
+    for name, columns in INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON relations({columns});")
+
+def insert_relations(cur : sqlite3.Cursor, relations):
+    cur.executemany("INSERT OR REPLACE INTO relations (subject, relation, object, extra, original_phrase, game_id, franchise_id) "
+                    "VALUES(:subject, :relation, :object, :extra, :original_phrase, :game_id, :franchise_id)",
+                    relations)
+
+def forget_subjects(cur : sqlite3.Cursor, subjects):
+    """Deletes every relation about the given subjects (matched case-insensitively)"""
+    cur.executemany("DELETE FROM relations WHERE subject_key = ?;", [(subject.strip().lower(),) for subject in subjects])
+
+def _has_wildcard(value):
+    return "%" in value or "_" in value
+
+def relations_query(like=False, **kwargs):
+    """
+    Builds the SQL and parameters for find_relations
+    Args:
+        like: If True, subject, relation and object match case-insensitively and may contain LIKE wildcards;
+              otherwise they must match exactly
+        kwargs: Column values to match
+    Returns:
+        (sql, parameters) tuple
+    """
+    conditions = []
+    parameters = []
+    for key, value in kwargs.items():
+        if key not in KEY_COLUMNS + ("game_id", "franchise_id", "original_phrase", "extra"):
+            raise ValueError(f"Unknown relations column: {key}")
+
+        if like and key in KEY_COLUMNS:
+            value = value.strip().lower()
+            if _has_wildcard(value):
+                conditions.append(f"{key}_key LIKE ?")
+            else:
+                # Same rows as LIKE without wildcards, but it can seek the index
+                conditions.append(f"{key}_key = ?")
+        else:
+            conditions.append(f"{key} = ?")
+        parameters.append(value)
+
+    return f"SELECT {RELATION_COLUMNS} FROM relations WHERE " + " AND ".join(conditions) + ";", tuple(parameters)
+
+def find_relations(cur : sqlite3.Cursor, like=False, **kwargs):
+    if len(kwargs) == 0: return []
+
+    return cur.execute(*relations_query(like, **kwargs)).fetchall()
+
+def sample_relation(cur : sqlite3.Cursor, game_only=False, franchise_id=None, attempts=32):
+    """
+    Draws a relation at random without sorting or scanning the table.
+    Random rowids between the smallest and largest one are probed until one exists (and passes the filters), which is
+    uniform over the matching rows however many gaps inserts and deletes have left. If all of them miss, the first
+    matching relation from one more random rowid on is taken, which favors the rows that follow gaps.
+    Args:
+        cur: Cursor of the games database
+        game_only: Only draw facts about games, not the ones users told about reality
+        franchise_id: Only draw facts about the games of this franchise
+        attempts: Number of rowids probed before taking the next matching relation
+    Returns:
+        A row of RELATION_COLUMNS, or None if there is no matching relation
+    """
+    if franchise_id is not None:
+        return _sample_franchise_relation(cur, franchise_id, game_only)
+
+    # Separate subqueries so that both use the min/max optimization instead of a scan
+    low, high = cur.execute("SELECT (SELECT MIN(rowid) FROM relations), (SELECT MAX(rowid) FROM relations);").fetchone()
+    if high is None: return None
+
+    condition = " AND game_id IS NOT NULL AND game_id != 'reality'" if game_only else ""
+    for _ in range(attempts):
+        row = cur.execute(f"SELECT {RELATION_COLUMNS} FROM relations WHERE rowid = ?" + condition + ";",
+                          (random.randint(low, high),)).fetchone()
+        if row is not None:
+            return row
+
+    # Wraps around to the rows before the start, which only filtered draws can need
+    start = random.randint(low, high)
+    for bound in ("rowid >= ?", "rowid < ?"):
+        row = cur.execute(f"SELECT {RELATION_COLUMNS} FROM relations WHERE {bound}{condition} ORDER BY rowid LIMIT 1;", (start,)).fetchone()
+        if row is not None:
+            return row
+    return None
+
+def _sample_franchise_relation(cur, franchise_id, game_only):
+    # Both steps only read the (game_id, subject_key) index for the games of the franchise
+    counts = cur.execute("SELECT game_id, COUNT(*) FROM relations"
+                         " WHERE game_id IN (SELECT game_id FROM in_franchise WHERE franchise_id = ?)"
+                         " GROUP BY game_id;", (franchise_id,)).fetchall()
+    if game_only:
+        counts = [(game_id, count) for game_id, count in counts if game_id != "reality"]
+    if not counts: return None
+
+    index = random.randrange(sum(count for _, count in counts))
+    for game_id, count in counts:
+        if index < count: break
+        index -= count
+
+    return cur.execute(f"SELECT {RELATION_COLUMNS} FROM relations WHERE game_id = ? LIMIT 1 OFFSET ?;", (game_id, index)).fetchone()
+
+# The lookups GameBot makes while answering questions
+HOT_QUERIES = [
+    {"like": True, "subject": "mario", "relation": "be"},
+    {"like": True, "subject": "there", "relation": "be", "game_id": "super-mario-bros"},
+    {"like": True, "relation": "be", "subject": "mario", "object": "a plumber"},
+    {"like": True, "subject": "mario"}, # "forget"
+    {"like": False, "subject": "mario"},
+    {"like": False, "game_id": "super-mario-bros"}
+]
+
+_FULL_SCAN = re.compile(r"^SCAN (TABLE )?relations\b(?!.*USING (COVERING )?INDEX)")
+
+def check_query_plans(cur : sqlite3.Cursor, queries=HOT_QUERIES):
+    """
+    Regression check: runs EXPLAIN QUERY PLAN on the hot relation lookups.
+    Returns a list of (sql, plan) for every query that would scan the whole relations table.
+    """
+    failures = []
+    for query in queries:
+        query = dict(query)
+        sql, parameters = relations_query(query.pop("like"), **query)
+        plan = [row[-1] for row in cur.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+        if any(_FULL_SCAN.match(step) for step in plan):
+            failures.append((sql, plan))
+
+    return failures
+
+if __name__ == "__main__":
+    # Usage: python relations.py [games.sqlite]
+    con = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else "games.sqlite")
+    create_relations_table(con.cursor())
+    con.commit()
+
+    failures = check_query_plans(con.cursor())
+    for sql, plan in failures:
+        print(f"Full table scan in: {sql}\n  " + "\n  ".join(plan))
+
+    print("All relation lookups use an index" if not failures else f"{len(failures)} lookups scan the relations table")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,49 @@
+"""
+Set-oriented lookups of games and franchises for the HLT Chatbot.
+Lookups take any number of ids and cost one query each: the ids are bound as a single JSON array and expanded with
+json_each, so the SQL text never changes and the statement stays in sqlite3's prepared-statement cache.
+"""
+import json
+import sqlite3
+
+# Explicit column list: the games table also has the scraper's bookkeeping columns (igdb_id, checksum, updated_at)
+GAME_COLUMNS = "id, name, release_date, summary, story, rating"
+
+def _ids(ids):
+    return json.dumps(list(dict.fromkeys(ids)))
+
+def games_by_ids(cur : sqlite3.Cursor, game_ids):
+    """
+    Looks up games by id
+    Returns:
+        List of rows of GAME_COLUMNS, in the order of game_ids (missing games are left out)
+    """
+    rows = {row[0]: row for row in cur.execute(f"SELECT {GAME_COLUMNS} FROM games"
+                                               " WHERE id IN (SELECT value FROM json_each(?));", (_ids(game_ids),))}
+    return [rows[game_id] for game_id in game_ids if game_id in rows]
+
+def game_by_id(cur : sqlite3.Cursor, game_id):
+    return cur.execute(f"SELECT {GAME_COLUMNS} FROM games WHERE id = ?;", (game_id,)).fetchone()
+
+def franchises_of_games(cur : sqlite3.Cursor, game_ids):
+    """
+    Looks up the franchises of several games at once
+    Returns:
+        Map of game id to a list of (id, name) franchise rows
+    """
+    franchises = {game_id: [] for game_id in game_ids}
+    for game_id, franchise_id, name in cur.execute("SELECT i.game_id, f.id, f.name FROM in_franchise i"
+                                                   "  JOIN franchises f ON f.id = i.franchise_id"
+                                                   " WHERE i.game_id IN (SELECT value FROM json_each(?))"
+                                                   " ORDER BY f.name;", (_ids(game_ids),)):
+        franchises[game_id].append((franchise_id, name))
+    return franchises
+
+def find_franchise(cur : sqlite3.Cursor, name):
+    """Looks up a franchise by name, case-insensitively; returns an (id, name) row or None"""
+    return cur.execute("SELECT id, name FROM franchises WHERE name LIKE ?;", (name,)).fetchone()
+
+def ensure_indexes(cur : sqlite3.Cursor):
+    """Indexes the lookups above need besides the primary keys"""
+    # The primary key of in_franchise starts with franchise_id
+    cur.execute("CREATE INDEX IF NOT EXISTS in_franchise_game ON in_franchise(game_id);")
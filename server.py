@@ -0,0 +1,149 @@
+"""
+Chat server for the HLT Chatbot: serves many conversations from one process.
+The protocol is line-oriented JSON over TCP. Each request is one line, either {"username": "..."} to pick the user of
+the conversation or {"text": "...", "id": ...} to say something (a plain text line is taken as the text), and each is
+answered with one line: {"id": ..., "lines": [...], "ok": ..., "cached": ...}.
+Answers are computed in a thread pool; each worker thread has its own GameBot and SQLite connection, and a
+conversation's username is set on the worker's bot for the duration of each request, so nothing is shared through the
+username row of the metadata table. The bots read in parallel (in WAL mode), write through one GroupCommitWriter and
+share one fuzzy title index.
+Usage: python server.py [--host HOST] [--port PORT] [--workers N] [--db games.sqlite] [--metrics-port PORT]
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from nltk import sent_tokenize
+
+from bot import GameBot
+import metrics
+from fuzzy import FuzzyTitleMatcher
+from storage import GroupCommitWriter
+from utils import load_nltk_data
+
+class Session:
+    """State of one conversation"""
+    def __init__(self, username=None):
+        self.username = username
+        self.requests = 0
+
+class GameBotServer:
+    def __init__(self, db_path="games.sqlite", workers=8):
+        """
+        Args:
+            db_path: Path of the games database
+            workers: Number of worker threads, each with its own GameBot
+        """
+        self.db_path = db_path
+        self.writer = GroupCommitWriter(db_path)
+        self.title_matcher = FuzzyTitleMatcher() # One copy of the title index instead of one per worker
+        load_nltk_data() # Before the workers use it concurrently
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gamebot")
+        self._local = threading.local()
+        self.sessions = 0
+
+    def _bot(self):
+        bot = getattr(self._local, "bot", None)
+        if bot is None:
+            bot = self._local.bot = GameBot(self.db_path, interactive=False, writer=self.writer,
+                                            title_matcher=self.title_matcher)
+        return bot
+
+    def answer(self, username, text):
+        """Answers every sentence of text as username; runs on a worker thread"""
+        bot = self._bot()
+        bot.username = username
+        lines = []
+        ok = cached = True
+        for sentence in sent_tokenize(text):
+            answer = bot.respond(sentence)
+            lines.extend(answer.messages())
+            ok = ok and answer.result is not None
+            cached = cached and answer.cached
+        return {"lines": lines, "ok": ok, "cached": cached}
+
+    async def handle(self, reader, writer):
+        session = Session()
+        self.sessions += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # Longer than the stream's limit; what's left of it can't be told from the next request
+                    writer.write(json.dumps({"lines": ["Request too long"], "ok": False, "id": None}).encode("utf-8") + b"\n")
+                    await writer.drain()
+                    break
+                if not line: break
+                line = line.decode("utf-8").strip()
+                if not line: continue
+
+                try:
+                    request = json.loads(line) if line.startswith("{") else {"text": line}
+                except json.JSONDecodeError as e:
+                    request = {}
+                    response = {"lines": [f"Invalid request: {e}"], "ok": False}
+                else:
+                    response = await self.respond(loop, session, request)
+
+                response["id"] = request.get("id")
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def respond(self, loop, session, request):
+        if "username" in request:
+            username = str(request["username"]).strip().lower()
+            if not username.isalnum():
+                return {"lines": ["Usernames must be one alphanumeric word"], "ok": False}
+            session.username = username
+            return {"lines": [f"Username selected: {username}"], "ok": True}
+
+        text = str(request.get("text", "")).strip()
+        if not text:
+            return {"lines": ["Nothing to answer"], "ok": False}
+        if session.username is None:
+            return {"lines": ["Pick a username first: {\"username\": \"...\"}"], "ok": False}
+
+        session.requests += 1
+        try:
+            return await loop.run_in_executor(self.executor, self.answer, session.username, text)
+        except Exception as e:
+            return {"lines": [f"Internal error: {e!r}"], "ok": False}
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle, host, port, limit=2**16)
+        print(f"GameBot server listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    ap = ArgumentParser(description="Serves GameBot conversations over line-oriented JSON on a TCP socket")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=8, help="Worker threads answering questions")
+    ap.add_argument("--db", default="games.sqlite", help="Path of the games database")
+    ap.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    ap.add_argument("--metrics-log", default=None, help="Append one JSON line of stage timings per answered sentence")
+    args = ap.parse_args()
+    
+    if args.metrics_port is not None or args.metrics_log is not None:
+        metrics.enable(args.metrics_log)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+
+    try:
+        asyncio.run(GameBotServer(args.db, args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
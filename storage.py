@@ -0,0 +1,122 @@
+"""
+SQLite storage settings and the group-commit writer of the HLT Chatbot.
+In WAL mode readers never wait for the writer, and with synchronous=NORMAL a commit only appends to the log instead of
+syncing the database. GroupCommitWriter funnels the writes of every conversation through one connection and commits
+whatever arrived within a short window together, so concurrent writers share commits instead of queueing for the lock.
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+def configure(con : sqlite3.Connection, wal=True, cache_mib=64):
+    """Applies the storage settings to a connection (WAL mode itself is stored in the database file)"""
+    if wal:
+        con.execute("PRAGMA journal_mode = WAL;")
+        con.execute("PRAGMA synchronous = NORMAL;")
+    con.execute(f"PRAGMA cache_size = -{cache_mib * 1024};")
+    con.execute("PRAGMA temp_store = MEMORY;")
+    con.execute("PRAGMA busy_timeout = 5000;")
+
+class GroupCommitWriter:
+    """Background thread that runs write jobs in batches, one transaction per batch"""
+    def __init__(self, db_path, max_delay=0.0005, max_batch=512):
+        """
+        Args:
+            db_path: Path of the database
+            max_delay: Seconds to wait for more jobs before committing a batch (0 to only take the jobs already queued)
+            max_batch: Maximum number of jobs per transaction
+        """
+        self.db_path = db_path
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.commits = 0
+        self.jobs = 0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, fn, *args):
+        """
+        Queues fn(cursor, *args) to run in the writer's next transaction
+        Returns:
+            A Future with fn's result, resolved once the transaction is committed; if fn raises, only its own changes
+            are rolled back and the Future gets the exception
+        """
+        if self._closed:
+            raise RuntimeError("The writer is closed")
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None: return None
+        batch = [job]
+
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None) # Stop after this batch
+                break
+            batch.append(job)
+
+        return batch
+
+    def _run(self):
+        con = sqlite3.connect(self.db_path, isolation_level=None) # Transactions are managed here
+        configure(con)
+        cur = con.cursor()
+
+        while True:
+            batch = self._next_batch()
+            if batch is None: break
+
+            results = []
+            try:
+                cur.execute("BEGIN IMMEDIATE;")
+                for fn, args, future in batch:
+                    # A savepoint per job, so that a failing job doesn't take the rest of the batch with it
+                    cur.execute("SAVEPOINT job;")
+                    try:
+                        results.append((future, fn(cur, *args), None))
+                    except Exception as e:
+                        cur.execute("ROLLBACK TO job;")
+                        results.append((future, None, e))
+                    cur.execute("RELEASE job;")
+                cur.execute("COMMIT;")
+            except sqlite3.Error as e:
+                if con.in_transaction:
+                    cur.execute("ROLLBACK;")
+                results = [(future, None, e) for fn, args, future in batch]
+            else:
+                self.commits += 1
+                self.jobs += len(batch)
+
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+        con.close()
+
+    def close(self):
+        """Commits the queued jobs and stops the thread"""
+        if self._closed: return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {"commits": self.commits, "jobs": self.jobs, "jobs_per_commit": self.jobs / self.commits if self.commits else 0.0}
@@ -0,0 +1,140 @@
+"""
+Tests of igdb_async.AsyncIGDBClient against StubIGDB, a local aiohttp stand-in for the IGDB API that can throttle or
+fail requests on demand and records when each one arrived.
+Usage: python -m pytest tests (or python -m unittest discover tests)
+"""
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+import igdb_async
+from igdb_async import AsyncIGDBClient, crawl_async
+from igdb_scrape import create_tables
+
+class StubIGDB:
+    """IGDB stand-in: answers every endpoint with canned results"""
+    def __init__(self, results=None, failures=None, latency=0.0):
+        """
+        Args:
+            results: Map of endpoint to the JSON result it answers with (an empty list by default)
+            failures: Map of endpoint to the HTTP statuses its first requests get instead (e.g. [429, 503])
+            latency: Seconds each request takes
+        """
+        self.results = results or {}
+        self.failures = {endpoint: list(statuses) for endpoint, statuses in (failures or {}).items()}
+        self.latency = latency
+        self.requests = [] # (arrival time, endpoint, body)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        endpoint = request.match_info["endpoint"]
+        self.requests.append((time.monotonic(), endpoint, await request.text()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency: await asyncio.sleep(self.latency)
+            statuses = self.failures.get(endpoint)
+            if statuses:
+                return web.Response(status=statuses.pop(0), text=json.dumps({"message": "Too Many Requests"}))
+            return web.json_response(self.results.get(endpoint, []))
+        finally:
+            self.in_flight -= 1
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/{endpoint}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def times(self, endpoint):
+        return [arrival for arrival, name, body in self.requests if name == endpoint]
+
+class AsyncIGDBClientTest(unittest.IsolatedAsyncioTestCase):
+    async def serve(self, **kwargs):
+        stub = await StubIGDB(**kwargs).start()
+        self.addAsyncCleanup(stub.stop)
+        return stub
+
+    async def test_pacing(self):
+        stub = await self.serve(latency=0.05)
+        rate, requests = 20, 40
+        async with AsyncIGDBClient("id", "token", stub.url, rate=rate, max_in_flight=4) as client:
+            await asyncio.gather(*(client.request("games", f"query {i};") for i in range(requests)))
+
+        self.assertLessEqual(stub.max_in_flight, 4)
+        times = stub.times("games")
+        self.assertEqual(len(times), requests)
+        # A full bucket lets the first `rate` requests through at once; the others are paced at `rate` per second
+        self.assertGreaterEqual(times[-1] - times[0], (requests - rate) / rate * 0.9)
+
+    async def test_retries_throttled_and_failed_requests(self):
+        stub = await self.serve(results={"games": [{"id": 1}]}, failures={"games": [429, 503]})
+        async with AsyncIGDBClient("id", "token", stub.url, rate=100) as client:
+            with mock.patch.object(random, "random", return_value=0.0):
+                self.assertEqual(await client.request("games", "fields id;"), [{"id": 1}])
+
+        self.assertEqual(len(stub.times("games")), 3)
+        self.assertTrue(all(body == "fields id;" for arrival, endpoint, body in stub.requests))
+
+    async def test_backoff_grows(self):
+        stub = await self.serve(failures={"games": [500, 500, 500]})
+        async with AsyncIGDBClient("id", "token", stub.url, rate=100) as client:
+            with mock.patch.object(random, "random", return_value=0.0):
+                await client.request("games", "fields id;")
+
+        # Without jitter, the delays are 0.125s, 0.25s and 0.5s
+        times = stub.times("games")
+        gaps = [later - earlier for later, earlier in zip(times[1:], times)]
+        self.assertEqual(len(gaps), 3)
+        for gap, delay in zip(gaps, (0.125, 0.25, 0.5)):
+            self.assertGreaterEqual(gap, delay * 0.9)
+        self.assertLess(gaps[0], gaps[1])
+        self.assertLess(gaps[1], gaps[2])
+
+    async def test_gives_up_after_max_retries(self):
+        stub = await self.serve(failures={"games": [429] * 3})
+        async with AsyncIGDBClient("id", "token", stub.url, rate=100, max_retries=2) as client:
+            with mock.patch.object(random, "random", return_value=0.0):
+                with self.assertRaises(IOError):
+                    await client.request("games", "fields id;")
+        self.assertEqual(len(stub.times("games")), 3)
+
+    async def test_crawl_writes_the_page(self):
+        stub = await self.serve(results={
+            "franchises": [{"id": 1, "name": "Metroid", "slug": "metroid", "games": [10]}],
+            "games": [{"id": 10, "name": "Metroid Prime", "slug": "metroid-prime", "checksum": "c10", "genres": [5]}],
+            "genres": [{"id": 5, "name": "Shooter"}],
+        })
+        con = sqlite3.connect(":memory:")
+        create_tables(con)
+        with mock.patch.object(igdb_async, "print", create=True):
+            offset = await crawl_async("id", "token", con, 0, max_pages=1, base_url=stub.url, rate=100)
+
+        self.assertEqual(offset, 1)
+        self.assertEqual(con.execute("SELECT name FROM games;").fetchall(), [("Metroid Prime",)])
+        self.assertEqual(con.execute("SELECT * FROM in_genre;").fetchall(), [("metroid-prime", "Shooter")])
+        self.assertEqual(con.execute("SELECT * FROM in_franchise;").fetchall(), [("metroid-prime", "metroid")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+"""
+Tests of intents: which lines the templates answer without a CoreNLP parse.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import match_intent, title_options
+
+class MatchIntentTest(unittest.TestCase):
+    def test_templates(self):
+        cases = {
+            "When was Halo released?": ("release", "Halo"),
+            "what's the rating of The Legend of Zelda?": ("rating", "The Legend of Zelda"),
+            "What is Portal 2's story?": ("story", "Portal 2"),
+            "What franchise is Metroid Prime part of?": ("franchise", "Metroid Prime"),
+            "Tell me something about the Mario franchise.": ("fact", "Mario franchise"),
+            "Tell me something": ("fact", None),
+        }
+        for line, expected in cases.items():
+            with self.subTest(line=line):
+                self.assertEqual(match_intent(line), expected)
+
+    def test_several_questions_take_the_full_parse(self):
+        for line in ("What is the rating of Halo? Also when was it released?",
+                     "When was Halo released? What is its rating?",
+                     "Tell me something about Halo? When was it released?"):
+            with self.subTest(line=line):
+                self.assertIsNone(match_intent(line))
+
+    def test_title_options(self):
+        self.assertEqual(title_options("The Witcher 3"), ["The Witcher 3", "Witcher 3"])
+        self.assertEqual(title_options("Halo"), ["Halo"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Tests of relations: random fact sampling and its filters.
+"""
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from relations import check_query_plans, create_relations_table, insert_relations, sample_relation
+
+def relation(subject, game_id, franchise_id=None):
+    return {"subject": subject, "relation": "be", "object": "here", "original_phrase": "is here", "extra": "",
+            "game_id": game_id, "franchise_id": franchise_id}
+
+class SampleRelationTest(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(":memory:")
+        self.cur = self.con.cursor()
+        create_relations_table(self.cur)
+        self.cur.execute("CREATE TABLE in_franchise (game_id TEXT NOT NULL, franchise_id TEXT NOT NULL);")
+
+    def test_empty(self):
+        self.assertIsNone(sample_relation(self.cur))
+        self.assertIsNone(sample_relation(self.cur, game_only=True))
+
+    def test_draws_every_relation(self):
+        insert_relations(self.cur, [relation(f"subject {i}", "game") for i in range(5)])
+        drawn = {sample_relation(self.cur)[0] for _ in range(200)}
+        self.assertEqual(drawn, {f"subject {i}" for i in range(5)})
+
+    def test_game_only(self):
+        insert_relations(self.cur, [relation(f"user fact {i}", "reality") for i in range(500)] + [relation("mario", "super-mario-bros")])
+        for _ in range(50):
+            self.assertEqual(sample_relation(self.cur, game_only=True)[5], "super-mario-bros")
+
+    def test_game_only_without_game_facts(self):
+        insert_relations(self.cur, [relation(f"user fact {i}", "reality") for i in range(10)])
+        self.assertIsNone(sample_relation(self.cur, game_only=True))
+        self.assertIsNotNone(sample_relation(self.cur))
+
+    def test_gaps(self):
+        insert_relations(self.cur, [relation(f"subject {i}", "game") for i in range(1000)])
+        self.cur.execute("DELETE FROM relations WHERE rowid BETWEEN 2 AND 999;")
+        for _ in range(50):
+            self.assertIn(sample_relation(self.cur, attempts=1)[0], ("subject 0", "subject 999"))
+
+    def test_franchise(self):
+        insert_relations(self.cur, [relation("mario", "super-mario-bros"), relation("link", "zelda"), relation("you", "reality")])
+        self.cur.executemany("INSERT INTO in_franchise VALUES (?, ?);", [("super-mario-bros", "mario"), ("reality", "mario")])
+        drawn = {sample_relation(self.cur, franchise_id="mario", game_only=True)[0] for _ in range(50)}
+        self.assertEqual(drawn, {"mario"})
+        self.assertIsNone(sample_relation(self.cur, franchise_id="metroid"))
+
+class QueryPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(":memory:")
+        self.cur = self.con.cursor()
+        create_relations_table(self.cur)
+
+    def test_hot_queries_use_an_index(self):
+        self.assertEqual(check_query_plans(self.cur), [])
+
+    def test_reports_full_scans(self):
+        for (name,) in self.cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL;").fetchall():
+            self.cur.execute(f"DROP INDEX {name};")
+        self.assertNotEqual(check_query_plans(self.cur), [])
+
+if __name__ == "__main__":
+    unittest.main()
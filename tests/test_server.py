@@ -0,0 +1,66 @@
+"""
+Tests of the connection handling of server.GameBotServer (requests that don't need NLTK data or a parse).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        db_path = os.path.join(directory.name, "games.sqlite")
+        sqlite3.connect(db_path).close()
+
+        with mock.patch.object(server, "load_nltk_data"):
+            self.bot_server = server.GameBotServer(db_path, workers=1)
+        self.addCleanup(self.bot_server.writer.close)
+        self.server = await asyncio.start_server(self.bot_server.handle, "127.0.0.1", 0, limit=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def request(self, reader, writer, line):
+        writer.write(line + b"\n")
+        await writer.drain()
+        return json.loads(await asyncio.wait_for(reader.readline(), 5))
+
+    async def test_username(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        response = await self.request(reader, writer, b'{"username": "tester", "id": 1}')
+        self.assertEqual(response, {"lines": ["Username selected: tester"], "ok": True, "id": 1})
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_request_too_long(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        response = await self.request(reader, writer, b'{"text": "' + b"a" * 4096 + b'"}')
+        self.assertFalse(response["ok"])
+        # The server closes the connection afterwards, cleanly
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b"")
+        writer.close()
+        await writer.wait_closed()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.bot_server.sessions, 0)
+
+    async def test_invalid_json(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        response = await self.request(reader, writer, b'{"username": ')
+        self.assertFalse(response["ok"])
+        self.assertEqual((await self.request(reader, writer, b'{"username": "tester"}'))["ok"], True)
+        writer.close()
+        await writer.wait_closed()
+
+if __name__ == "__main__":
+    unittest.main()
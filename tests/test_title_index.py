@@ -0,0 +1,61 @@
+"""
+Tests of title_index: title normalization (case, accents, compatibility forms) and keeping ascii_names in sync.
+"""
+import os
+import sqlite3
+import sys
+import unicodedata
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from igdb_scrape import create_tables
+from title_index import ensure_ascii_names, ensure_title_index, normalize_title, search_titles
+
+class NormalizeTitleTest(unittest.TestCase):
+    def test_folding(self):
+        cases = {
+            "Pokémon": "pokemon",
+            "POKEMON": "pokemon",
+            unicodedata.normalize("NFD", "Pokémon Épée"): "pokemon epee",
+            "Assassin's Creed": "assassins creed",
+            "Straße": "strasse",
+            "ＰＯＫＥＭＯＮ": "pokemon",
+            # Compatibility decompositions that produce capitals
+            "Halo™": "halotm",
+            "ℌalo": "halo",
+            "Ⅻ Knights": "xii knights",
+            "ポケモン ガ": "ポケモン ガ",
+        }
+        for title, expected in cases.items():
+            with self.subTest(title=title):
+                self.assertEqual(normalize_title(title), expected)
+
+    def test_folded_titles_are_lowercase(self):
+        for title in ("Halo™", "ℌalo", "Ⅻ", "㎒", "ǅ"):
+            with self.subTest(title=title):
+                folded = normalize_title(title)
+                self.assertEqual(folded, folded.casefold())
+
+class AsciiNamesTest(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(":memory:")
+        create_tables(self.con)
+
+    def add_game(self, game_id, name):
+        self.con.execute("INSERT INTO games (id, name, summary, story) VALUES (?, ?, '', '');", (game_id, name))
+        self.con.commit()
+
+    def test_renormalizing_adds_missing_games(self):
+        # Written without store_ascii_names, by a normalizer version older than the current one
+        self.add_game("portal", "Portal")
+        self.con.execute("DELETE FROM metadata_numbers WHERE key = 'ascii_names_version';")
+        self.con.commit()
+
+        ensure_ascii_names(self.con)
+        ensure_title_index(self.con)
+        self.assertEqual(self.con.execute("SELECT game_id, value FROM ascii_names;").fetchall(), [("portal", "portal")])
+        self.assertEqual([row[0] for row in search_titles(self.con.cursor(), "Portal")], ["portal"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+"""
+Game title lookup for the HLT Chatbot.
+Normalized titles live in the ascii_names table, which the code writing games keeps up to date with store_ascii_names;
+this module also keeps an FTS5 trigram index over them so substring lookups don't have to scan the whole table, and ranks
+the matches by relevance.
+"""
+import sqlite3
+import unicodedata
+
+from repository import GAME_COLUMNS
+
+# Letters that Unicode doesn't decompose into a base letter and an accent
+_LETTERS = {"æ": "ae", "œ": "oe", "ø": "o", "đ": "d", "ð": "d", "ħ": "h", "ı": "i", "ł": "l", "þ": "th", "ŧ": "t"}
+
+# Apostrophes vanish ("Assassin's" -> "assassins"); other punctuation separates words
+_APOSTROPHES = {"'", "\u2018", "\u2019", "\u02bc", "`", "\u00b4"}
+
+# Scripts whose accents are dropped; in others (e.g. kana) the marks are part of the letter
+_ACCENTED_SCRIPTS = ("LATIN", "GREEK", "CYRILLIC")
+
+# Blocks of the accents those scripts use, dropped even when NFC has no precomposed letter to merge them into
+_DIACRITICS = ((0x0300, 0x036F), (0x1AB0, 0x1AFF), (0x1DC0, 0x1DFF), (0x20D0, 0x20FF), (0xFE20, 0xFE2F))
+
+# Bump when the folding changes, so that ensure_ascii_names normalizes the stored titles again
+NORMALIZER_VERSION = 4
+
+def _fold(char):
+    if any(start <= ord(char) <= end for start, end in _DIACRITICS): return ""
+    folded = []
+    char = char.casefold()
+    # Compatibility decompositions can bring capitals back ("™" -> "TM", "ℌ" -> "H"), so they're case folded again
+    decomposed = unicodedata.normalize("NFKD", unicodedata.normalize("NFKD", char).casefold())
+    accented = unicodedata.name(decomposed[0], "").startswith(_ACCENTED_SCRIPTS)
+    if not accented:
+        decomposed = unicodedata.normalize("NFKC", unicodedata.normalize("NFKC", char).casefold())
+    for c in decomposed:
+        if (accented and unicodedata.combining(c)) or c in _APOSTROPHES: continue
+        if unicodedata.category(c)[0] in "PZC":
+            folded.append(" ")
+        else:
+            folded.append(_LETTERS.get(c, c))
+    return "".join(folded)
+
+class _FoldTable(dict):
+    """str.translate table that folds each character the first time it's seen and remembers the result"""
+    def __missing__(self, codepoint):
+        folded = _fold(chr(codepoint))
+        self[codepoint] = folded
+        return folded
+
+_fold_table = _FoldTable()
+
+def normalize_title(text):
+    """
+    Folds a title for matching: accents, ligatures and case are folded ("Pokémon" and "POKEMON" both become
+    "pokemon"), apostrophes are dropped, other punctuation becomes a space, and whitespace is collapsed.
+    Titles and queries both go through this, so they compare equal whenever a user would expect them to.
+    """
+    # Characters are folded one at a time, so accents typed as separate combining marks are composed first
+    return " ".join(unicodedata.normalize("NFC", text).translate(_fold_table).split())
+
+# Older name
+normalize_encoding = normalize_title
+
+def register_functions(con : sqlite3.Connection):
+    """Registers normalize_title(name) on the connection, for the queries that normalize stored titles in bulk"""
+    con.create_function("normalize_title", 1, normalize_title, deterministic=True)
+
+def store_ascii_names(con : sqlite3.Connection, games):
+    """
+    Writes the normalized titles of games that were inserted or renamed; called by everything that writes to games.
+    Doesn't commit, so it can be part of the transaction writing the games.
+    Args:
+        con: Connection of the games database
+        games: Iterable of (game id, title) pairs
+    """
+    rows = [(game_id, normalize_title(name)) for game_id, name in games]
+    # Renamed games get a new rowid for FuzzyTitleMatcher.refresh to pick up; unchanged titles are left alone
+    con.executemany("DELETE FROM ascii_names WHERE game_id = ? AND value != ?;", rows)
+    con.executemany("INSERT INTO ascii_names (game_id, value) SELECT ?1, ?2 WHERE NOT EXISTS"
+                    " (SELECT 1 FROM ascii_names WHERE game_id = ?1);", rows)
+
+def ensure_ascii_names(con : sqlite3.Connection):
+    """
+    Creates ascii_names, normalizing the titles of the games already there once, when the table is created (or when a
+    database still has the triggers that used to fill it). Afterwards this only checks that the titles were normalized
+    by the current NORMALIZER_VERSION, so it takes the same time however many games there are.
+    """
+    register_functions(con)
+    created = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ascii_names';").fetchone() is None
+    con.execute("CREATE TABLE IF NOT EXISTS ascii_names ("
+                "  game_id TEXT NOT NULL PRIMARY KEY,"
+                "  value TEXT NOT NULL,"
+                "  FOREIGN KEY(game_id) REFERENCES games(id)"
+                ");")
+
+    # The triggers called normalize_title, which only exists on connections that registered it
+    triggers = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'games_ascii_names_insert';").fetchone() is not None
+    if created or triggers:
+        _backfill_ascii_names(con)
+
+    con.execute("CREATE TABLE IF NOT EXISTS metadata_numbers ("
+                "  key TEXT NOT NULL PRIMARY KEY,"
+                "  value INTEGER"
+                ")")
+    version = next(iter(con.execute("SELECT value FROM metadata_numbers WHERE key = 'ascii_names_version';")), (None,))[0]
+    if version != NORMALIZER_VERSION:
+        renormalize_titles(con)
+
+def renormalize_titles(con : sqlite3.Connection):
+    """
+    Normalizes all stored titles again with the current normalize_title; only the ones that change get written, and
+    games missing from ascii_names (e.g. written by code that didn't maintain it) are added
+    """
+    with con:
+        con.execute("UPDATE ascii_names SET value = n.value"
+                    "  FROM (SELECT id, normalize_title(name) AS value FROM games) AS n"
+                    " WHERE n.id = ascii_names.game_id AND n.value != ascii_names.value;")
+        con.execute("INSERT INTO ascii_names (game_id, value)"
+                    " SELECT id, normalize_title(name) FROM games WHERE id NOT IN (SELECT game_id FROM ascii_names);")
+        con.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES ('ascii_names_version', ?);", (NORMALIZER_VERSION,))
+
+def _backfill_ascii_names(con):
+    with con:
+        for name in ("games_ascii_names_insert", "games_ascii_names_update", "games_ascii_names_delete"):
+            con.execute(f"DROP TRIGGER IF EXISTS {name};")
+        con.execute("INSERT INTO ascii_names (game_id, value)"
+                    " SELECT id, normalize_title(name) FROM games WHERE id NOT IN (SELECT game_id FROM ascii_names);")
+
+def ensure_title_index(con : sqlite3.Connection):
+    """
+    Creates the ascii_names_fts index and the triggers that keep it in sync with ascii_names.
+    Returns False if this SQLite build has no FTS5 trigram tokenizer (SQLite < 3.34), in which case search_titles
+    falls back to LIKE scans.
+    """
+    exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = 'ascii_names_fts';").fetchone() is not None
+    if exists:
+        if con.execute("SELECT 1 FROM sqlite_master WHERE name = 'ascii_names_fts_replace';").fetchone() is None:
+            # Indexes made before this trigger existed may have missed replaced rows
+            _create_replace_trigger(con)
+            con.execute("INSERT INTO ascii_names_fts (ascii_names_fts) VALUES ('rebuild');")
+            con.commit()
+        return True
+
+    try:
+        con.execute("CREATE VIRTUAL TABLE ascii_names_fts USING fts5("
+                    "  value,"
+                    "  content='ascii_names',"
+                    "  content_rowid='rowid',"
+                    "  tokenize='trigram'"
+                    ");")
+    except sqlite3.OperationalError as e:
+        print(f"Title index unavailable ({e}); falling back to LIKE lookups")
+        return False
+
+    con.execute("CREATE TRIGGER IF NOT EXISTS ascii_names_fts_insert AFTER INSERT ON ascii_names BEGIN"
+                "  INSERT INTO ascii_names_fts (rowid, value) VALUES (new.rowid, new.value);"
+                " END;")
+    con.execute("CREATE TRIGGER IF NOT EXISTS ascii_names_fts_delete AFTER DELETE ON ascii_names BEGIN"
+                "  INSERT INTO ascii_names_fts (ascii_names_fts, rowid, value) VALUES ('delete', old.rowid, old.value);"
+                " END;")
+    con.execute("CREATE TRIGGER IF NOT EXISTS ascii_names_fts_update AFTER UPDATE ON ascii_names BEGIN"
+                "  INSERT INTO ascii_names_fts (ascii_names_fts, rowid, value) VALUES ('delete', old.rowid, old.value);"
+                "  INSERT INTO ascii_names_fts (rowid, value) VALUES (new.rowid, new.value);"
+                " END;")
+    _create_replace_trigger(con)
+    con.execute("INSERT INTO ascii_names_fts (ascii_names_fts) VALUES ('rebuild');")
+    con.commit()
+
+    return True
+
+def _create_replace_trigger(con):
+    # INSERT OR REPLACE only fires the delete trigger for the replaced row with PRAGMA recursive_triggers on, which is
+    # per connection; deleting the row beforehand works on every connection
+    con.execute("CREATE TRIGGER IF NOT EXISTS ascii_names_fts_replace BEFORE INSERT ON ascii_names BEGIN"
+                "  DELETE FROM ascii_names WHERE game_id = new.game_id;"
+                " END;")
+
+_GAME_COLUMNS = ", ".join("g." + column.strip() for column in GAME_COLUMNS.split(","))
+
+def _has_index(cur):
+    return cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'ascii_names_fts';").fetchone() is not None
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_titles(cur : sqlite3.Cursor, descriptor : str, limit : int = 50):
+    """
+    Finds games whose normalized title contains the normalized descriptor.
+    If some titles match the descriptor exactly, only those are returned. Otherwise, prefix matches come first, then
+    other substring matches, shorter titles first.
+    Args:
+        cur: Cursor of the games database
+        descriptor: (Part of) a game title
+        limit: Maximum number of games to return
+    Returns:
+        List of rows of repository.GAME_COLUMNS
+    """
+    descriptor = normalize_title(descriptor)
+    if not descriptor: return []
+
+    escaped = _escape_like(descriptor)
+    rank = ("CASE WHEN a.value = ? THEN 0 WHEN a.value LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END")
+
+    if len(descriptor) >= 3 and _has_index(cur):
+        # The trigram tokenizer turns a quoted phrase into a substring match
+        rows = cur.execute("SELECT " + rank + ", " + _GAME_COLUMNS + " FROM ascii_names_fts f"
+                           "  JOIN ascii_names a ON a.rowid = f.rowid"
+                           "  JOIN games g ON g.id = a.game_id"
+                           " WHERE ascii_names_fts MATCH ?"
+                           " ORDER BY 1, length(a.value)"
+                           " LIMIT ?;",
+                           (descriptor, escaped + "%", '"' + descriptor.replace('"', '""') + '"', limit)).fetchall()
+    else:
+        # Too short for trigrams (or no FTS5); scan
+        rows = cur.execute("SELECT " + rank + ", " + _GAME_COLUMNS + " FROM ascii_names a"
+                           "  JOIN games g ON g.id = a.game_id"
+                           " WHERE a.value LIKE ? ESCAPE '\\'"
+                           " ORDER BY 1, length(a.value)"
+                           " LIMIT ?;",
+                           (descriptor, escaped + "%", "%" + escaped + "%", limit)).fetchall()
+
+    if rows and rows[0][0] == 0:
+        rows = [row for row in rows if row[0] == 0]
+
+    return [row[1:] for row in rows]
@@ -0,0 +1,142 @@
+"""
+Indexed view of a parse tree for the HLT Chatbot.
+GameBot probes each parse a dozen times or more (find_node_by_tag, remove_tag, detokenized leaves). A TreeIndex is built
+with one walk over the tree and answers those probes from tables: the nodes in pre-order with their parents, subtree
+ends and ranges of leaves, and the nodes of each label (and of each label prefix, such as "VB*") in breadth-first order.
+Every subtree of the indexed tree points back to the index, so utils.find_node_by_tag and utils.node_text use it for any
+node of the tree; copies made with Tree.copy() are plain trees again.
+The index is a snapshot: a tree shouldn't be modified in place once it's indexed.
+"""
+from itertools import chain
+
+import nltk
+
+def tag_patterns(tags):
+    """Normalizes a tag, a pattern such as "VB*" or a tuple of them into a tuple"""
+    return (tags,) if isinstance(tags, (str, bytes)) else tuple(tags)
+
+def tag_matcher(tags):
+    """Function telling whether a label matches the tags (a tag, a "VB*"-style pattern, a tuple of them or a function)"""
+    if callable(tags): return tags
+    patterns = tag_patterns(tags)
+    exact = {tag for tag in patterns if not tag.endswith("*")}
+    prefixes = tuple(tag[:-1] for tag in patterns if tag.endswith("*"))
+    if not prefixes: return exact.__contains__
+    return lambda label: label in exact or label.startswith(prefixes)
+
+class TreeIndex:
+    def __init__(self, tree : nltk.Tree):
+        self.tree = tree
+        # Per node, in pre-order: the node, its parent's position and label, the end of its subtree (so that the
+        # descendants of node i are the positions from i + 1 to ends[i]) and its range of leaves
+        self.nodes = nodes = []
+        self.parents = parents = []
+        self.labels = labels = []
+        self.ends = ends = []
+        self.leaf_start = leaf_start = []
+        self.leaf_end = leaf_end = []
+        self.leaves = leaves = []
+        self._positions = positions = {} # id(node) -> position
+        self._levels = levels = [] # Positions at each depth, left to right
+        self._by_label = None # label -> positions in breadth-first order
+        self._by_pattern = {} # tuple of tags -> positions in breadth-first order
+        self.texts = {} # Cache of utils.node_text
+
+        Tree = nltk.Tree
+        def visit(node, parent, depth):
+            position = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            labels.append(node.label())
+            ends.append(0)
+            leaf_start.append(len(leaves))
+            leaf_end.append(0)
+            positions[id(node)] = position
+            if depth == len(levels): levels.append([])
+            levels[depth].append(position)
+            node._tree_index = self
+
+            for child in node:
+                if isinstance(child, Tree):
+                    visit(child, position, depth + 1)
+                else:
+                    leaves.append(child)
+
+            ends[position] = len(nodes)
+            leaf_end[position] = len(leaves)
+
+        visit(tree, -1, 0)
+
+    def position(self, node):
+        """Pre-order position of node, or None if it isn't part of the indexed tree"""
+        position = self._positions.get(id(node))
+        if position is None or self.nodes[position] is not node: return None
+        return position
+
+    def _matching(self, tags):
+        if self._by_label is None:
+            # find_node_by_tag counts matches level by level
+            self._breadth_first = list(chain.from_iterable(self._levels))
+            self._rank = [0] * len(self.nodes)
+            self._by_label = {}
+            for rank, position in enumerate(self._breadth_first):
+                self._rank[position] = rank
+                self._by_label.setdefault(self.labels[position], []).append(position)
+
+        if callable(tags):
+            return [position for position in self._breadth_first if tags(self.labels[position])]
+        key = tag_patterns(tags)
+        positions = self._by_pattern.get(key)
+        if positions is None:
+            matches = tag_matcher(key)
+            lists = [positions for label, positions in self._by_label.items() if matches(label)]
+            positions = self._by_pattern[key] = lists[0] if len(lists) == 1 else sorted(chain.from_iterable(lists), key=self._rank.__getitem__)
+        return positions
+
+    def find(self, node, tags, which=1, recursive=False):
+        """
+        Same as utils.find_node_by_tag on a node of the indexed tree: the which-th child (or, if recursive, descendant in
+        breadth-first order) of node whose label matches tags
+        """
+        parent = self.position(node)
+        end = self.ends[parent]
+        counter = 0
+        for position in self._matching(tags):
+            if parent < position < end and (recursive or self.parents[position] == parent):
+                counter += 1
+                if counter >= which: return self.nodes[position]
+        return None
+
+    def node_leaves(self, node, without=(), recursive=False):
+        """
+        The leaves of node, optionally leaving out the subtrees with the given tags like utils.remove_tag would (only
+        among its children, or at any depth if recursive)
+        """
+        position = self.position(node)
+        start, end = self.leaf_start[position], self.leaf_end[position]
+        if not without: return self.leaves[start:end]
+
+        removed = []
+        subtree_end = self.ends[position]
+        for other in self._matching(without):
+            if position < other < subtree_end and (recursive or self.parents[other] == position):
+                removed.append((self.leaf_start[other], self.leaf_end[other]))
+
+        leaves = []
+        for removed_start, removed_end in sorted(removed):
+            # Subtrees inside removed ones overlap them
+            if removed_start > start: leaves.extend(self.leaves[start:removed_start])
+            start = max(start, removed_end)
+        leaves.extend(self.leaves[start:end])
+        return leaves
+
+def index_tree(tree):
+    """Indexes tree and returns it"""
+    TreeIndex(tree)
+    return tree
+
+def get_index(node):
+    """The TreeIndex node belongs to, or None"""
+    index = getattr(node, "_tree_index", None)
+    if index is None or index.position(node) is None: return None
+    return index
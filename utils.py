@@ -4,25 +4,17 @@ from nltk import pos_tag, word_tokenize, sent_tokenize
 from nltk.tokenize.treebank import TreebankWordDetokenizer
 from nltk.corpus import wordnet as wn
 from nltk.stem import WordNetLemmatizer
-from corenlp import parser
+from corenlp import get_parser, start_parsers, corenlp_version
+from cache import PersistentCache, make_key
+from relations import create_relations_table, insert_relations
+from title_index import normalize_encoding
+from tree_index import get_index, tag_matcher, tag_patterns
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import sqlite3
-import re
-
-# Adapted from https://stackoverflow.com/questions/517923/what-is-the-best-way-to-remove-accents-normalize-in-a-python-unicode-string
-# Answer by RiGonz on StackOverflow
-def normalize_encoding(old):
-    """
-    Removes common accent characters, lower form.
-    Uses: regex.
-    """
-    new = old.lower()
-    new = re.sub(r'[àáâãäå]', 'a', new)
-    new = re.sub(r'[èéêë]', 'e', new)
-    new = re.sub(r'[ìíîï]', 'i', new)
-    new = re.sub(r'[òóôõö]', 'o', new)
-    new = re.sub(r'[ùúûü]', 'u', new)
-    return new
+import bisect
+import queue
 
 def and_join(strings):
     strings = list(strings)
@@ -33,15 +25,15 @@ def and_join(strings):
     else:
         return ', '.join(strings[:-1]) + ' and ' + strings[-1]
 
+@metrics.timed("remove_tag")
 def remove_tag(np, tags="PP", recursive=False):
-    if isinstance(tags, (str, bytes)):
-        tags = (tags,)
+    matches = tag_matcher(tags)
         
     np = np.copy()
     i = 0
     while i < len(np):
         if not isinstance(np[i], (str, bytes)):
-            if np[i].label() in tags:
+            if matches(np[i].label()):
                 np.pop(i)
                 i -= 1
             else:
@@ -79,16 +71,24 @@ def collect_nps(tree):
     
     return s
 
+@metrics.timed("find_node_by_tag")
 def find_node_by_tag(tree, tags, which=1, recursive=False):
-    if not isinstance(tags, (tuple, list)) and not callable(tags):
-        tags = (tags,)
+    """
+    Finds the which-th child of tree (or descendant, breadth-first, if recursive) whose label matches tags: a tag, a
+    prefix pattern such as "VB*", a tuple of them or a function of the label. Nodes of an indexed tree (see
+    tree_index.index_tree) are answered from the index instead of walking the tree.
+    """
+    index = get_index(tree)
+    if index is not None:
+        return index.find(tree, tags, which, recursive)
     
+    matches = tag_matcher(tags)
     counter = 0
     
     while len(tree) > 0:
         for node in tree:
             if isinstance(node, (str, bytes)): continue
-            if (callable(tags) and tags(node.label())) or (not callable(tags) and node.label() in tags):
+            if matches(node.label()):
                 counter += 1
                 if counter >= which:
                     return node
@@ -145,9 +145,27 @@ class _Pointer:
 
 twd = TreebankWordDetokenizer()
 
+@metrics.timed("detokenize")
 def detokenize(tokens):
     return twd.detokenize(tokens)
 
+def node_text(node, without=(), recursive=False):
+    """
+    detokenize(node.leaves()), or the same for remove_tag(node, without, recursive); for nodes of an indexed tree, the
+    text comes from the index and is computed once per node
+    """
+    index = get_index(node)
+    if index is None:
+        if without: node = remove_tag(node, without, recursive)
+        return detokenize(node.leaves())
+    
+    key = (index.position(node), without if callable(without) else tag_patterns(without), recursive)
+    text = index.texts.get(key)
+    if text is None:
+        text = index.texts[key] = detokenize(index.node_leaves(node, without, recursive))
+    return text
+
+@metrics.timed("capitalize_all")
 def capitalize_all(s):
     return detokenize([word.capitalize() for word in word_tokenize(s)])
 
@@ -235,24 +253,181 @@ def collect_vps(tree, ptr=None):
 
 wnl = WordNetLemmatizer()
 
-def advanced_parse(sent : str):
-    result = parser.api_call(sent, # "The end of the world is upon us, and Mario Kart 3 won't help."
-                             properties={"annotators": "tokenize,ssplit,pos,parse,ner,openie"})
+def load_nltk_data():
+    """
+    Loads the NLTK data used while answering and preprocessing (WordNet, the POS tagger and punkt) on this thread.
+    NLTK's lazy corpus loaders replace themselves with the loaded corpus on first use without a lock, so call this
+    before starting threads that use them, or their first concurrent uses can fail.
+    """
+    wn.ensure_loaded()
+    wnl.lemmatize("games", "v")
+    pos_tag(word_tokenize("Mario jumps over the pipe."))
+
+ANNOTATORS = "tokenize,ssplit,pos,parse,ner,openie"
+
+annotation_cache = None
+
+def enable_annotation_cache(path="annotations.sqlite", max_bytes=1024 * 2**20):
+    """Makes advanced_parse and advanced_parse_many reuse annotations stored in a persistent cache"""
+    global annotation_cache
+    annotation_cache = PersistentCache(path, max_bytes=max_bytes)
+    return annotation_cache
+
+def _annotation_key(sent, annotators):
+    return make_key(sent, annotators, corenlp_version)
+
+def _compact_sentence(sent):
+    # Only keep what _unpack_sentence needs
+    return {
+        "parse": sent["parse"],
+        "entitymentions": sent.get("entitymentions", []),
+        "openie": sent["openie"],
+        "tokens": sent["tokens"]
+    }
+
+def _unpack_sentence(sent):
+    # Same as CoreNLPParser.make_tree, without needing a server for cached annotations
+    return nltk.Tree.fromstring(sent["parse"]), sent.get("entitymentions", []), sent["openie"], sent["tokens"]
+
+def advanced_parse(sent : str, nlp=None):
+    if annotation_cache is not None:
+        key = _annotation_key(sent, ANNOTATORS)
+        cached = annotation_cache.get(key)
+        if cached is not None:
+            return _unpack_sentence(cached)
+    
+    metrics.count("corenlp_calls")
+    with metrics.span("corenlp"):
+        result = (nlp or get_parser()).api_call(sent, # "The end of the world is upon us, and Mario Kart 3 won't help."
+                                 properties={"annotators": ANNOTATORS})
     
     sent = result["sentences"][0]
-    return parser.make_tree(sent), sent.get("entitymentions", []), sent["openie"], sent["tokens"]
+    if annotation_cache is not None:
+        annotation_cache.put(key, _compact_sentence(sent))
+    return _unpack_sentence(sent)
+
+def _utf16_len(text):
+    # CoreNLP reports character offsets in Java (UTF-16) code units
+    return len(text.encode("utf-16-le")) // 2
+
+def advanced_parse_many(sents, timeout=300, nlp=None):
+    """
+    Parses several sentences with a single CoreNLP call.
+    The sentences are sent one per line with ssplit.eolonly, so the server never merges or splits them.
+    Returns a list with one advanced_parse-style tuple per input sentence (None if the server returned nothing for it).
+    """
+    sents = [' '.join(sent.split()) for sent in sents] # Newlines inside a sentence would split it
+    parsed = [None] * len(sents)
+    
+    # Only the sentences missing from the annotation cache are sent to the server
+    missing = list(range(len(sents)))
+    if annotation_cache is not None:
+        keys = [_annotation_key(sent, ANNOTATORS + "|eolonly") for sent in sents]
+        missing = []
+        for i, key in enumerate(keys):
+            cached = annotation_cache.get(key)
+            if cached is not None:
+                parsed[i] = _unpack_sentence(cached)
+            else:
+                missing.append(i)
+    
+    if not missing: return parsed
+    
+    starts = []
+    offset = 0
+    for i in missing:
+        starts.append(offset)
+        offset += _utf16_len(sents[i]) + 1
+    
+    metrics.count("corenlp_calls")
+    with metrics.span("corenlp"):
+        result = (nlp or get_parser()).api_call("\n".join(sents[i] for i in missing),
+                                 properties={"annotators": ANNOTATORS, "ssplit.eolonly": "true"},
+                                 timeout=timeout)
+    
+    for sent in result["sentences"]:
+        if not sent["tokens"]: continue
+        
+        # Map the sentence back to its input line through the offset of its first token
+        index = missing[bisect.bisect_right(starts, sent["tokens"][0]["characterOffsetBegin"]) - 1]
+        if parsed[index] is None:
+            parsed[index] = _unpack_sentence(sent)
+            if annotation_cache is not None:
+                annotation_cache.put(keys[index], _compact_sentence(sent))
+    
+    return parsed
 
 #[{'docTokenBegin': 10, 'docTokenEnd': 12, 'tokenBegin': 10, 'tokenEnd': 12, 'text': 'Mario Kart', 'characterOffsetBegin': 37, 'characterOffsetEnd': 47, 'ner': 'PERSON', 'nerConfidences': {'PERSON': 0.72344230621544}}, {'docTokenBegin':
 # 12, 'docTokenEnd': 13, 'tokenBegin': 12, 'tokenEnd': 13, 'text': '3', 'characterOffsetBegin': 48, 'characterOffsetEnd': 49, 'ner': 'NUMBER', 'normalizedNER': '3.0', 'nerConfidences': {'NUMBER': -1}}]
 
 def collect_relations(sent, title="game"):
-    relations = []
     try:
-        tree, entities, openie, tokens = advanced_parse(sent)
+        parsed = advanced_parse(sent)
     except requests.exceptions.HTTPError as e:
         print(f"API call failed for sentence: {sent}")
         traceback.print_exc()
-        return relations
+        return []
+    
+    return relations_from_parse(parsed, title)
+
+def collect_relations_many(documents, max_chars=50000, nlp=None):
+    """
+    Batched version of collect_relations for whole documents.
+    Args:
+        documents: Iterable of (key, title, texts) tuples, e.g. (game_id, name, [summary, story])
+        max_chars: Maximum number of characters sent to CoreNLP in a single call
+        nlp: CoreNLPParser to use instead of the default one
+    Returns:
+        Dictionary mapping each key to the list of relations found in its texts
+    """
+    relations = {}
+    bundle = [] # (key, title, sentence)
+    bundle_chars = 0
+    
+    def flush():
+        nonlocal bundle_chars
+        if not bundle: return
+        
+        try:
+            parsed = advanced_parse_many([sent for _, _, sent in bundle], nlp=nlp)
+        except requests.exceptions.HTTPError as e:
+            # Fall back to one sentence at a time so that a single bad sentence doesn't lose the whole bundle
+            print(f"Batched API call failed for {len(bundle)} sentences; retrying them one by one")
+            parsed = [None] * len(bundle)
+            for i, (_, _, sent) in enumerate(bundle):
+                try:
+                    parsed[i] = advanced_parse(sent, nlp=nlp)
+                except requests.exceptions.HTTPError as e:
+                    print(f"API call failed for sentence: {sent}")
+                    traceback.print_exc()
+        
+        for (key, title, sent), item in zip(bundle, parsed):
+            if item is not None:
+                relations[key].extend(relations_from_parse(item, title))
+        
+        bundle.clear()
+        bundle_chars = 0
+    
+    for key, title, texts in documents:
+        relations.setdefault(key, [])
+        
+        for sent in better_sent_tokenize([text for text in texts if text]):
+            if not sent.strip(): continue # Ignore blank text
+            
+            if bundle and bundle_chars + len(sent) > max_chars:
+                flush()
+            
+            bundle.append((key, title, sent))
+            bundle_chars += len(sent) + 1
+    
+    flush()
+    
+    return relations
+
+def relations_from_parse(parsed, title="game"):
+    """Extracts relations from the result of advanced_parse"""
+    relations = []
+    tree, entities, openie, tokens = parsed
     
     replace_with_title = ("it", "game")
     
@@ -304,19 +479,19 @@ def collect_relations(sent, title="game"):
     
     return relations
 
-def preprocess_db(con : sqlite3.Connection, cur : sqlite3.Cursor, start : int = 0, limit : int = 1000):
-    # TODO: Mark "there be" as existential
-    # cur.execute("DROP TABLE IF EXISTS relations;")
-    cur.execute("CREATE TABLE IF NOT EXISTS relations ("
-                "  subject TEXT NOT NULL,"
-                "  relation TEXT NOT NULL,"
-                "  object TEXT NOT NULL,"
-                "  original_phrase TEXT NOT NULL," # Original phrase
-                "  extra TEXT," # Optional extra text
-                "  game_id TEXT NOT NULL," # Optional game_id
-                "  franchise_id TEXT," # Optional franchise id
-                "  PRIMARY KEY(subject, relation, object, game_id)"
-                ");")
+def _game_relations(game_id, found, added):
+    """Turns the relations found for a game into rows, skipping duplicates already in `added`"""
+    rows = []
+    for entry in found:
+        key = (entry["subject"], entry["relation"], entry["object"], game_id)
+        if key not in added:
+            rows.append({**entry, "game_id": game_id, "franchise_id": None})
+            added.add(key)
+    
+    return rows
+
+def preprocess_db(con : sqlite3.Connection, cur : sqlite3.Cursor, start : int = 0, limit : int = 1000, batch_size : int = 16):
+    create_relations_table(cur)
     
     relations = []
     added = set()
@@ -324,26 +499,214 @@ def preprocess_db(con : sqlite3.Connection, cur : sqlite3.Cursor, start : int =
     
     print("Stating processing at position", position)
     
-    for (game_id, name, summary, story) in tqdm(list(cur.execute(f"SELECT id, name, summary, story FROM games LIMIT {limit} OFFSET {start};")), unit="game"):
-        position += 1
-        for sent in better_sent_tokenize([summary, story]):
-            if not sent.strip(): continue # Ignore blank text
+    games = list(cur.execute(f"SELECT id, name, summary, story FROM games LIMIT {limit} OFFSET {start};"))
+    
+    with tqdm(total=len(games), unit="game") as progress:
+        # Several games are annotated per CoreNLP call; relations are mapped back to their game_id
+        for i in range(0, len(games), batch_size):
+            batch = games[i:i + batch_size]
+            with metrics.span("preprocess.annotate"):
+                found = collect_relations_many((game_id, name, [summary, story]) for (game_id, name, summary, story) in batch)
+            
+            for (game_id, name, summary, story) in batch:
+                position += 1
+                relations.extend(_game_relations(game_id, found[game_id], added))
             
-            for entry in collect_relations(sent, name):
-                key = (entry["subject"], entry["relation"], entry["object"], game_id)
-                if key not in added:
-                    relations.append({**entry, "game_id": game_id, "franchise_id": None})
-                    added.add(key)
+            metrics.count("preprocess.games", len(batch))
+            progress.update(len(batch))
     
     try:
-        cur.executemany("INSERT OR REPLACE INTO relations (subject, relation, object, extra, original_phrase, game_id, franchise_id) "
-                        "VALUES(:subject, :relation, :object, :extra, :original_phrase, :game_id, :franchise_id)",
-                        relations)
-        cur.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES('bot_preprocess_offset', ?)", (position,))
-        
-        con.commit()
+        with metrics.span("preprocess.write"):
+            insert_relations(cur, relations)
+            cur.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES('bot_preprocess_offset', ?)", (position,))
+            
+            con.commit()
     except Exception as e:
         traceback.print_exc()
     
     if len(relations) > 0:
         code.interact(local=locals())
+
+def _pooled_annotator(parsers):
+    """
+    Returns a thread-safe function that annotates a batch of (id, name, summary, story) rows with whichever parser is free.
+    Without parsers, batches go to the shared parser, which is only started once a sentence misses the annotation cache.
+    """
+    available = queue.Queue()
+    for nlp in parsers or [None]:
+        available.put(nlp)
+    
+    def work(batch):
+        nlp = available.get()
+        try:
+            with metrics.span("preprocess.annotate"):
+                return collect_relations_many(((game_id, name, [summary, story]) for (game_id, name, summary, story) in batch), nlp=nlp)
+        finally:
+            available.put(nlp)
+    
+    return work
+
+def preprocess_db_parallel(con : sqlite3.Connection, cur : sqlite3.Cursor, start : int = 0, limit : int = 1000,
+                           workers : int = 4, batch_size : int = 16, parsers=None):
+    """
+    Parallel version of preprocess_db.
+    Batches of games are annotated by a pool of worker threads, each holding one CoreNLP server at a time, while this
+    thread acts as the single writer: batches are committed in order, together with the bot_preprocess_offset marker,
+    so the offset never moves past a game whose relations haven't been written.
+    Args:
+        con, cur: Connection and cursor of the games database
+        start: Offset of the first game to process
+        limit: Maximum number of games to process
+        workers: Number of worker threads (and CoreNLP servers started, unless parsers is given)
+        batch_size: Number of games annotated per CoreNLP call
+        parsers: Optional list of CoreNLPParsers to use instead of starting new servers
+    Returns:
+        The offset of the first unprocessed game
+    """
+    create_relations_table(cur)
+    
+    if parsers is None:
+        print(f"Starting {workers} CoreNLP servers...")
+        parsers = start_parsers(workers)
+    
+    work = _pooled_annotator(parsers)
+    games = list(cur.execute(f"SELECT id, name, summary, story FROM games LIMIT {limit} OFFSET {start};"))
+    batches = [games[i:i + batch_size] for i in range(0, len(games), batch_size)]
+    position = start
+    
+    print("Stating parallel processing at position", position)
+    
+    load_nltk_data()
+    with ThreadPoolExecutor(max_workers=len(parsers)) as executor, tqdm(total=len(games), unit="game") as progress:
+        # map() yields results in submission order, so the offset only ever advances over finished games
+        for batch, found in zip(batches, executor.map(work, batches)):
+            relations = []
+            for (game_id, name, summary, story) in batch:
+                relations.extend(_game_relations(game_id, found[game_id], set()))
+            
+            position += len(batch)
+            with metrics.span("preprocess.write"):
+                insert_relations(cur, relations)
+                cur.execute("INSERT OR REPLACE INTO metadata_numbers (key, value) VALUES('bot_preprocess_offset', ?)", (position,))
+                con.commit()
+            
+            progress.update(len(batch))
+    
+    return position
+
+def preprocess_db_streaming(con : sqlite3.Connection, cur : sqlite3.Cursor, chunk_size : int = 64, batch_size : int = 16,
+                            limit : int = None, parsers=None):
+    """
+    Streaming, resumable version of preprocess_db, meant for unattended runs.
+    Games are read with keyset pagination on id, and each chunk of games is committed in a single transaction together
+    with the id of its last game (the bot_preprocess_last_id key of the metadata table), so a killed run loses at most
+    one chunk and the next run picks up right after the last committed game. Memory use is bounded by one chunk.
+    Args:
+        con, cur: Connection and cursor of the games database
+        chunk_size: Number of games committed per transaction
+        batch_size: Number of games annotated per CoreNLP call
+        limit: Maximum number of games to process in this run (None for all of them)
+        parsers: Optional list of CoreNLPParsers; if there are several, the batches of a chunk are annotated in parallel
+    Returns:
+        Number of games processed
+    """
+    create_relations_table(cur)
+    cur.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                "  key TEXT NOT NULL PRIMARY KEY,"
+                "  value TEXT NOT NULL"
+                ");")
+    con.commit()
+    
+    last_id = next(iter(cur.execute("SELECT value FROM metadata WHERE key = 'bot_preprocess_last_id';")), ('',))[0]
+    # New games the scraper queued are dequeued as they're reached, so preprocess_changed doesn't process them again
+    queued = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'changed_games';").fetchone() is not None
+    work = _pooled_annotator(parsers)
+    processed = 0
+    
+    print("Starting streaming processing after game", repr(last_id))
+    
+    load_nltk_data()
+    with ThreadPoolExecutor(max_workers=len(parsers or [None])) as executor, tqdm(unit="game") as progress:
+        while limit is None or processed < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - processed)
+            games = cur.execute("SELECT id, name, summary, story FROM games WHERE id > ? ORDER BY id LIMIT ?;", (last_id, size)).fetchall()
+            if not games: break
+            
+            batches = [games[i:i + batch_size] for i in range(0, len(games), batch_size)]
+            relations = []
+            for batch, found in zip(batches, executor.map(work, batches)):
+                for (game_id, name, summary, story) in batch:
+                    relations.extend(_game_relations(game_id, found[game_id], set()))
+            
+            last_id = games[-1][0]
+            try:
+                with metrics.span("preprocess.write"):
+                    insert_relations(cur, relations)
+                    if queued: cur.executemany("DELETE FROM changed_games WHERE game_id = ?", [(game[0],) for game in games])
+                    cur.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES('bot_preprocess_last_id', ?)", (last_id,))
+                    con.commit()
+            except sqlite3.Error:
+                con.rollback()
+                raise
+            
+            processed += len(games)
+            metrics.count("preprocess.games", len(games))
+            progress.update(len(games))
+    
+    return processed
+
+def preprocess_changed(con : sqlite3.Connection, cur : sqlite3.Cursor, chunk_size : int = 64, batch_size : int = 16, parsers=None):
+    """
+    Extracts the relations of the games igdb_scrape.py added or changed (the changed_games table) again.
+    Each chunk replaces the old relations of its games and leaves changed_games in one transaction. Games after the
+    cursor of preprocess_db_streaming are left for it to reach.
+    Args:
+        con, cur: Connection and cursor of the games database
+        chunk_size: Number of games committed per transaction
+        batch_size: Number of games annotated per CoreNLP call
+        parsers: Optional list of CoreNLPParsers; if there are several, the batches of a chunk are annotated in parallel
+    Returns:
+        Number of games processed
+    """
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'changed_games';").fetchone() is None:
+        return 0
+    create_relations_table(cur)
+    cur.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                "  key TEXT NOT NULL PRIMARY KEY,"
+                "  value TEXT NOT NULL"
+                ");")
+    last_id = next(iter(cur.execute("SELECT value FROM metadata WHERE key = 'bot_preprocess_last_id';")), ('',))[0]
+    
+    work = _pooled_annotator(parsers)
+    processed = 0
+    
+    load_nltk_data()
+    with ThreadPoolExecutor(max_workers=len(parsers or [None])) as executor:
+        while True:
+            games = cur.execute("SELECT g.id, g.name, g.summary, g.story FROM changed_games c JOIN games g ON g.id = c.game_id"
+                                " WHERE c.game_id <= ? ORDER BY c.game_id LIMIT ?;", (last_id, chunk_size)).fetchall()
+            if not games: break
+            
+            batches = [games[i:i + batch_size] for i in range(0, len(games), batch_size)]
+            relations = []
+            for batch, found in zip(batches, executor.map(work, batches)):
+                for (game_id, name, summary, story) in batch:
+                    relations.extend(_game_relations(game_id, found[game_id], set()))
+            
+            ids = [(game[0],) for game in games]
+            try:
+                cur.executemany("DELETE FROM relations WHERE game_id = ?", ids)
+                insert_relations(cur, relations)
+                cur.executemany("DELETE FROM changed_games WHERE game_id = ?", ids)
+                con.commit()
+            except sqlite3.Error:
+                con.rollback()
+                raise
+            
+            processed += len(games)
+    
+    # Games that no longer exist have nothing to extract
+    cur.execute("DELETE FROM changed_games WHERE game_id NOT IN (SELECT id FROM games);")
+    con.commit()
+    
+    return processed